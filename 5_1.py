@@ -2,12 +2,15 @@ from nltk import CFG, Tree
 from pprint import pprint
 import copy
 
+import tracing
+from parse_utils import first_follow_sets, first_of_sequence, topdown_productions
+
 # question1.py
 # Jonas Kuhn, University of Stuttgart, 2020
 # course "Parsing"
 
-# Boolean variable for switching tracing info on and off
-trace = True  # set this to False if you don't want to see intermediate steps
+# subscriber for the parsing events (see tracing.py); set this to None if you don't want to see intermediate steps
+trace = tracing.print_events
 
 # Boolean variable for running parser interactively on user input or on pre-specified input
 interactive = False # True
@@ -52,7 +55,7 @@ def parse(G, tokens, first):
     # G:      dict with list of reversed rhs's for each non-terminal
     # tokens: list of input tokens
 
-    if trace: print("parsing ", tokens, "...")
+    if trace: trace("parse", tokens=tokens)
 
     # initialize data structures:
     stack = ['S']
@@ -61,11 +64,11 @@ def parse(G, tokens, first):
 
     # main loop:
     while len(inbuffer) > 0:
-        if trace: print('           {:<40}{:>40}'.format(str(stack), str(inbuffer)))
+        if trace: trace("item", stack=list(stack), rest=list(inbuffer))
 
         # expand
         if stack != [] and stack[-1] in G and stack[-1] != inbuffer[0]:
-            if trace: print(" >expand:   ", stack[-1], "    -R->    ", G[stack[-1]][0])
+            if trace: trace("expand", symbol=stack[-1], rhs=G[stack[-1]][0])
             replace = stack[-1]
             if [inbuffer[0]] in G[replace]:
                 right = G[replace][G[replace].index([inbuffer[0]])]
@@ -89,17 +92,17 @@ def parse(G, tokens, first):
 
         # match
         elif stack != [] and stack[-1] == inbuffer[0]:
-            if trace: print(" >match:   ", stack[-1], "    -R->    ", inbuffer[0])
+            if trace: trace("match", symbol=stack[-1])
             seq.append((stack[-1], 0))
             del stack[-1]
             del inbuffer[0]
 
         # no match:
         else:
-            if trace: print(" >dead end!")
+            if trace: trace("backtrack", reason="dead end")
             break
 
-    if trace: print('           {:<40}{:>40}'.format(str(stack), str(inbuffer)))
+    if trace: trace("item", stack=list(stack), rest=list(inbuffer))
 
     # termination
     if stack == inbuffer == []:
@@ -138,6 +141,90 @@ def first_sets(grammar):
     return first
 
 
+# ------------------------------------------------------------------
+# LL(1) parser generator:
+# the grammar is compiled once into a parse table, so the driver never has to search or guess
+
+def ll1_candidates(G):
+    # candidates[(NT, token)]: the productions (reversed rhs, as in G) that NT can be expanded with
+    # when token is the next input symbol ('$' for the end of the input)
+    nullable, first, follow = first_follow_sets(topdown_productions(G))
+    candidates = {}
+    for NT in G:
+        for production in G[NT]:
+            right = list(reversed(production))
+            lookahead = first_of_sequence(right, G, nullable, first)
+            if all(X in nullable for X in right):
+                lookahead = lookahead | follow[NT]
+            for token in lookahead:
+                candidates.setdefault((NT, token), [])
+                if production not in candidates[(NT, token)]:
+                    candidates[(NT, token)].append(production)
+    return candidates
+
+
+def ll1_conflicts(G):
+    # a triple (NT, token, productions) for every table cell with more than one candidate
+    # (the grammar is LL(1) iff there are none)
+    candidates = ll1_candidates(G)
+    return [(NT, token, candidates[(NT, token)]) for (NT, token) in candidates if len(candidates[(NT, token)]) > 1]
+
+
+def build_ll1_table(G):
+    # returns the LL(1) parse table: table[(NT, token)] is the production (reversed rhs, as in G)
+    # to expand NT with when token is the next input symbol ('$' for the end of the input)
+    # raises ValueError if the grammar is not LL(1) (see ll1_conflicts): the driver would have to
+    # guess, and would silently lose the parses of the other candidates
+    candidates = ll1_candidates(G)
+    conflicts = [(NT, token) for (NT, token) in candidates if len(candidates[(NT, token)]) > 1]
+    if conflicts:
+        raise ValueError("grammar is not LL(1): " + str(len(conflicts)) + " conflicts, e.g. "
+                         + str(conflicts[0][0]) + " on " + repr(conflicts[0][1]) + " (see ll1_conflicts)")
+    return {(NT, token): candidates[(NT, token)][0] for (NT, token) in candidates}
+
+
+def parse_ll1(table, tokens):
+    # table:  LL(1) parse table from build_ll1_table
+    # tokens: list of input tokens
+    # every step either matches a token or makes a table lookup, so this runs in linear time
+    # returns the sequence of (symbol, arity) pairs (see build_tree), or None if the input is rejected
+
+    if trace: trace("parse", tokens=tokens, method="LL(1)")
+
+    stack = ['S']
+    pos = 0
+    seq = []
+    while stack != []:
+        lookahead = tokens[pos] if pos < len(tokens) else '$'
+        if trace: trace("item", stack=list(stack), rest=tokens[pos:])
+
+        # expand
+        if (stack[-1], lookahead) in table:
+            production = table[(stack[-1], lookahead)]
+            if trace: trace("expand", symbol=stack[-1], rhs=production)
+            seq.append((stack[-1], len(production)))
+            del stack[-1]
+            stack += production
+
+        # match
+        elif stack[-1] == lookahead:
+            if trace: trace("match", symbol=stack[-1])
+            seq.append((stack[-1], 0))
+            del stack[-1]
+            pos += 1
+
+        # no table entry
+        else:
+            if trace: trace("backtrack", reason="no table entry for " + str(stack[-1]) + " and " + str(lookahead))
+            return None
+
+    if pos < len(tokens):
+        if trace: trace("backtrack", reason="input left after the stack is empty")
+        return None
+    if trace: trace("success")
+    return seq
+
+
 def demo():
     G = load_grammar(grammar1)
     first = first_sets(G)
@@ -178,5 +265,19 @@ def demo():
         parsetree[0].draw()
         print("Answer: There aren't any improvements, because the algorythm only looks how it can parse the next word\
 and still takes the first rule it finds.")
+        print("LL(1) parse table")
+        G = load_grammar(grammar1)
+        table = build_ll1_table(G)
+        print("conflicts for grammar1:", ll1_conflicts(G))
+        for sentence in ["( - 2 / 3 )", "( ( 3 / 2 ) * ( - 4 + 6 ) )", "( - 2 - ( - - - - - 8 + - - - 3 ) )", "( 3 + )"]:
+            sequence = parse_ll1(table, sentence.split())
+            if sequence is not None:
+                parsetree = build_tree(sequence)
+                parsetree[0].draw()
+        print("conflicts for linguistic_grammar (no LL(1) table):")
+        for (NT, token, productions) in ll1_conflicts(load_grammar(linguistic_grammar)):
+            print("   ", NT, token, productions)
+
 
-demo()
\ No newline at end of file
+if __name__ == "__main__":
+    demo()
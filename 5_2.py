@@ -1,13 +1,15 @@
 from nltk import CFG, Tree
-import copy
 from pprint import pprint
 
+import tracing
+from parse_utils import lookahead_table, push_all, stack_to_list
+
 # question1.py (edited by Pavlos Musenidis)
 # Jonas Kuhn, University of Stuttgart, 2020
 # course "Parsing"
 
-# Boolean variable for switching tracing info on and off
-trace = True  # set this to False if you don't want to see intermediate steps
+# subscriber for the parsing events (see tracing.py)
+trace = tracing.print_events  # set this to None if you don't want to see intermediate steps
 
 # Boolean variable for running parser interactively on user input or on pre-specified input
 interactive = False # True
@@ -41,88 +43,109 @@ def load_grammar(grammar):
 
 
 # main procedure:
-def parse(G, tokens):
-    # G:      dict with list of reversed rhs's for each non-terminal
-    # tokens: list of input tokens
+def parse(G, tokens, lookahead=None, stats=None):
+    # G:         dict with list of reversed rhs's for each non-terminal
+    # tokens:    list of input tokens
+    # lookahead: optional result of lookahead_table(G); if given, only the productions that
+    #            can start with the next input token are put on the agenda
+    # stats:     optional parse_stats.ParseStats, filled in with the statistics of this parse
+
+    # returns the list of all solutions (the search itself is done by iter_parses)
+    return list(iter_parses(G, tokens, lookahead, stats))
+
 
-    if trace: print("parsing ", tokens, "...")
+def iter_parses(G, tokens, lookahead=None, stats=None):
+    # generator version of parse (same arguments): yields each solution (the sequence of expansions
+    # and matches) when stack and input are used up together; the alternative expansions saved
+    # on the agenda are only tried when the next solution is asked for (see parse_utils.first_parse)
+    # stats are filled in when the search is exhausted or the generator is closed
+
+    if trace: trace("parse", tokens=tokens)
+    if stats is not None: stats.start()
 
     # initialize data structures:
-    stack = ['S']
-    inbuffer = tokens
-    seq = []
+    # stack and seq are persistent stacks (see parse_utils.push_all): alternatives share everything below the top
+    # instead of deep copies; pos is the index of the next input token
+    stack = ('S', None)
+    pos = 0
+    seq = None
     agenda = []
-    solutions = []
-
-    # main loop:
-    while True:
-        if trace: print('           {:<40}{:>40}'.format(str(stack), str(inbuffer)))
-
-        # expand
-        if stack != [] and inbuffer != [] and stack[-1] in G:
-            replace = stack[-1]
-            if [inbuffer[0]] in G[replace]:
-                if trace: print(" >expand:   ", stack[-1], "    -R->    ", G[stack[-1]][0])
-                right = G[replace][G[replace].index([inbuffer[0]])]
-                seq.append((stack[-1], len(right)))
-                del stack[-1]
-                stack += right
-            else:
-                for production in G[replace]:
-                    new_seq = copy.deepcopy(seq)
-                    new_stack = copy.deepcopy(stack)
-                    new_inbuffer = copy.deepcopy(inbuffer)
-                    new_seq.append((new_stack[-1], len(production)))
-                    del new_stack[-1]
-                    new_stack += production
-                    last = production
-                    agenda.append((new_stack, new_inbuffer, new_seq))
-                stack = agenda[-1][0]
-                inbuffer = agenda[-1][1]
-                seq = agenda[-1][2]
-                del agenda[-1]
-                if trace: print(" >expand:   ", replace, "    -R->    ", last)
-
-
-        # match
-        elif stack != [] and inbuffer != [] and stack[-1] == inbuffer[0]:
-            if trace: print(" >match:   ", stack[-1], "    -R->    ", inbuffer[0])
-            seq.append((stack[-1], 0))
-            del stack[-1]
-            del inbuffer[0]
-
-
-        # termination
-        elif stack == inbuffer == []:
-            if trace: print('           {:<40}{:>40}'.format(str(stack), str(inbuffer)))
-            solutions.append(seq)
-            print("found one solution!\n")
-            if agenda != []:
-                print("searching for more solutions...\n")
-                stack = agenda[-1][0]
-                inbuffer = agenda[-1][1]
-                seq = agenda[-1][2]
-                del agenda[-1]
-            else:
-                if solutions != []:
-                    print("failure!\n\n\n\n\n\n\n")
+    # counters for stats:
+    steps = 0
+    expands = 0
+    matches = 0
+    dead_ends = 0
+    max_agenda = 0
+    found = 0
+
+    try:
+        # main loop:
+        while True:
+            steps += 1
+            if trace: trace("item", stack=stack_to_list(stack), rest=tokens[pos:])
+
+            # expand
+            # (with lookahead, a non-terminal without any production for the next token is a dead end)
+            if stack is not None and pos < len(tokens) and stack[0] in G and \
+                    (lookahead is None or tokens[pos] in lookahead[stack[0]]):
+                replace = stack[0]
+                if [tokens[pos]] in G[replace]:
+                    right = G[replace][G[replace].index([tokens[pos]])]
+                    if trace: trace("expand", symbol=replace, rhs=right)
+                    expands += 1
+                    seq = ((replace, len(right)), seq)
+                    stack = push_all(stack[1], right)
                 else:
-                    print("success!\n\n\n\n\n\n\n")
-                return solutions
-        else:
-            if trace: print(" >dead end!")
-            if agenda != []:
-                print("searching for more solutions...\n")
-                stack = agenda[-1][0]
-                inbuffer = agenda[-1][1]
-                seq = agenda[-1][2]
-                del agenda[-1]
+                    if lookahead is None:
+                        productions = G[replace]
+                    else:
+                        productions = lookahead[replace][tokens[pos]]
+                    for production in productions:
+                        agenda.append((push_all(stack[1], production), pos, ((replace, len(production)), seq)))
+                        last = production
+                    expands += len(productions)
+                    max_agenda = max(max_agenda, len(agenda))
+                    (stack, pos, seq) = agenda.pop()
+                    if trace: trace("expand", symbol=replace, rhs=last)
+
+
+            # match
+            elif stack is not None and pos < len(tokens) and stack[0] == tokens[pos]:
+                if trace: trace("match", symbol=stack[0])
+                seq = ((stack[0], 0), seq)
+                stack = stack[1]
+                pos += 1
+                matches += 1
+
+
+            # termination
+            elif stack is None and pos == len(tokens):
+                if trace: trace("success")
+                found += 1
+                yield stack_to_list(seq)
+                if agenda != []:
+                    (stack, pos, seq) = agenda.pop()
+                else:
+                    if trace: trace("solutions", count=found)
+                    return
             else:
-                if solutions == []:
-                    print("failure!\n\n\n\n\n\n\n")
+                if trace: trace("backtrack", reason="dead end")
+                dead_ends += 1
+                if agenda != []:
+                    (stack, pos, seq) = agenda.pop()
                 else:
-                    print("success!\n\n\n\n\n\n\n")
-                return solutions
+                    if trace: trace("solutions", count=found)
+                    return
+    finally:
+        if stats is not None:
+            stats.lap("search")
+            stats.steps = steps
+            stats.max_agenda = max_agenda
+            stats.expands = expands
+            stats.matches = matches
+            stats.dead_ends = dead_ends
+            stats.solutions = found
+            stats.stop()
 
 
 def build_tree(seq):
@@ -140,6 +163,7 @@ def build_tree(seq):
 
 def demo():
     G = load_grammar(grammar)
+    table = lookahead_table(G)
     if trace: print("Internal grammar representation:\n", grammar)
 
     if interactive:
@@ -149,7 +173,7 @@ def demo():
             sentence = input('Type sentence or type "q" to exit: ') # user can input the string to be parsed
             if sentence != "q":
                 tokens = sentence.split() # split up string in tokens (using the default separator, i.e. space)sequence = parse(G, tokens)
-                solutions = parse(G, tokens)
+                solutions = parse(G, tokens, table)
                 for sequence in solutions:
                     parsetree = build_tree(sequence)
                     parsetree[0].draw()
@@ -157,20 +181,22 @@ def demo():
                 exit()
     else:
         tokens = "the elephant saw the mouse".split()
-        solutions = parse(G, tokens)
+        solutions = parse(G, tokens, table)
         for sequence in solutions:
             parsetree = build_tree(sequence)
             parsetree[0].draw()
         tokens = "I shot the elephant shot my pajamas".split()
-        solutions = parse(G, tokens)
+        solutions = parse(G, tokens, table)
         for sequence in solutions:
             parsetree = build_tree(sequence)
             parsetree[0].draw()
         tokens = "I shot the elephant in my pajamas".split()
-        solutions = parse(G, tokens)
+        solutions = parse(G, tokens, table)
         for sequence in solutions:
             parsetree = build_tree(sequence)
             parsetree[0].draw()
 
 
-demo()
+
+if __name__ == "__main__":
+    demo()
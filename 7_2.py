@@ -2,20 +2,27 @@
 # Jonas Kuhn, University of Stuttgart, 2020
 # course "Parsing"
 
-from nltk import CFG, Tree
+# The shift-reduce agenda search itself lives in 7_3.py (with the start symbol as a parameter);
+# this script runs it on grammar_left_recursion with the start symbol 'S' and shows the trees.
 
-trace = True  # False
+import importlib
+
+import tracing
+
+shift_reduce = importlib.import_module("7_3")
+
+trace = tracing.print_events  # None   (subscriber for the parsing events, see tracing.py)
+# (the search events come from 7_3.py: set shift_reduce.trace as well to silence them)
 interactive = True
-show_action = True  # False
 
 # string format used in nltk class:
 # our test grammar:
 
 grammar_left_recursion = """
-S -> NP VP 
+S -> NP VP
 NP -> NP N |DET N | DET N PP | 'I'
 VP -> V | V NP | V NP PP
-PP -> P NP 
+PP -> P NP
 DET -> 'the' | 'an' | 'my' | 'most'
 P -> 'in'
 N -> 'elephant' | 'elephants' | 'mouse' | 'mice' | 'pajamas' | 'fish' | 'factory' | 'worker'
@@ -27,104 +34,54 @@ V -> 'sneezed' | 'giggled' | 'trumpeted' | 'saw' | 'shot'
 #       should follow the form of this example: '( 3 * ( 7 / - 2 ) )'
 
 
-# conversion procedure for grammar:
-def load_grammar(grammar):
-    G = {}
-    cfg = CFG.fromstring(grammar)
-    for p in cfg.productions():
-        p = p.__str__().split()
-        for i in range(len(p)):
-            p[i] = p[i].strip("'")
-        left = p[2:]
-        production = tuple(left)
-        G.setdefault(production, [])
-        G[production].append(p[0])
-    return G
-
-# recursive procedure for converting sequence of arity/symbol pairs into a tree
-# (this version generates a representation format that can be graphically displayed
-# using an nltk method)
-def build_tree(deriv):
-    if len(deriv) > 0:
-        (arity, NT) = deriv[-1]
-
-        Subtrees = []
-        deriv_rest = deriv[:-1]
-        for i in range(arity):
-            (Subtree_i, deriv_rest) = build_tree(deriv_rest)
-            Subtrees = [Subtree_i] + Subtrees
-        return Tree(NT, Subtrees), deriv_rest
-    else:
-        return_deriv = list(deriv)
-        return [], return_deriv
+# grammar format, tree building and reduce trie as in 7_3.py:
+load_grammar = shift_reduce.load_grammar
+build_tree = shift_reduce.build_tree
+build_reduce_trie = shift_reduce.build_reduce_trie
 
 
 # ------------------------------------------------------------------
 # main procedure:
-def parse_with_agenda(G, tokens):
-    # G:      dict with list of reversed rhs's for each non-terminal
+def parse_with_agenda(G, tokens, trie=None, stats=None, dedupe=False, agenda=None):
+    # G:      dict from RHS tuples to lists of LHS's (see load_grammar)
     # tokens: list of input tokens
+    # trie:   result of build_reduce_trie(G); built on the fly if not given
+    # stats:  optional parse_stats.ParseStats, filled in with the statistics of this parse
+    # dedupe: explore every stack top only once (see parse_with_dedupe in 7_3.py)
+    # agenda: optional empty agenda object, e.g. an agenda.BestFirstAgenda with one of the scoring
+    #         functions of agenda.py (default: a list, i.e. depth-first search; not used with dedupe)
 
-    if trace: print("parsing ", tokens, "...")
-
-    # initialize agenda:
-    agenda = [([], tokens, [])]
-    # initalize list for collecting complete solutions:
-    parses = []
-
-    # main loop:
-    while len(agenda) > 0:
-        (stack, inbuffer, deriv) = agenda.pop()
-
-        # accept
-        if stack == ['S'] and inbuffer == []:
-            print(" >accept!")
-            parses += [deriv]
-
-        elif stack == ['S'] and len(inbuffer) > 0:
-            if show_action: print(" >backtracking (stack or buffer was empty)")
-            # again: we need to do nothing; next agenda item will be considered
-
-        else:
-            # shift
-            if len(inbuffer) > 0:
-                if trace: print('           {:<40}{:>40}'.format(str(stack), str(inbuffer)))
-                if show_action: print(" >shift:  ", inbuffer[0])
-                stack1 = stack + [inbuffer[0]]
-                if stack1 != []:
-                    deriv1 = deriv + [(0, stack1[-1])]
-                else:
-                    deriv1 = list(deriv)
-                inbuffer1 = inbuffer[1:]
-                agenda += [(stack1, inbuffer1, deriv1)]
-
-            # reduce
-            for i in range(0, len(stack)):
-                if tuple(stack[i:len(stack)]) in G:
-                    if trace: print('           {:<40}{:>40}'.format(str(stack), str(inbuffer)))
-                    if show_action: print(" >reduce: ", stack[i:len(stack)], " -R-> ", G[tuple(stack[i:len(stack)])])
-                    deriv1 = deriv + [(len(stack[i:len(stack)]), G[tuple(stack[i:len(stack)])])]
-                    stack1 = stack[0:i] + G[tuple(stack[i:len(stack)])]
-                    inbuffer1 = list(inbuffer)
-                    agenda += [(stack1, inbuffer1, deriv1)]
-
-    if trace: print(len(parses), ' solutions')
+    # returns the same pair as parse_with_agenda in 7_3.py (number of steps, number of solutions)
 
+    search = iter_parses(G, tokens, trie, stats, dedupe, agenda)
     sol = 0
-    for deriv in parses:
+    while True:
+        try:
+            deriv = next(search)
+        except StopIteration as finished:
+            counter = finished.value
+            break
         sol += 1
-        tree, subtrees = build_tree(deriv)
-        print("solution ", sol)
-        print(deriv)
-        tree.draw()
+        if trace: trace("solution", number=sol, deriv=deriv)
+        if interactive:
+            tree, subtrees = build_tree(deriv)
+            tree.draw()
+    if stats is not None:
+        stats.lap("readout")
+    return counter, sol
+
+
+def iter_parses(G, tokens, trie=None, stats=None, dedupe=False, agenda=None):
+    # generator version of parse_with_agenda (same arguments), see iter_parses in 7_3.py
+    return (yield from shift_reduce.iter_parses(G, tokens, trie, 'S', stats, dedupe, agenda))
 
 
 G = load_grammar(grammar_left_recursion)
-print("Grammar:\n", G)
-print("-------------------------------------------------\n")
 
 
 def demo():
+    print("Grammar:\n", G)
+    print("-------------------------------------------------\n")
     if interactive:
         while True:
             sentence = input('Type sentence ("q" to quit): ')
@@ -149,6 +106,7 @@ def demo():
         sentence = 'I saw the fish factory worker'
         tokens = sentence.split()
         parse_with_agenda(G, tokens)
-demo()
 
 
+if __name__ == "__main__":
+    demo()
@@ -0,0 +1,107 @@
+# agenda.py
+# course "Parsing"
+
+# Best-first agendas for the agenda parsers (question3.py, 7_2.py, 7_3.py).
+# The parsers use a plain list as agenda (last in, first out, i.e. depth-first search), so the time to
+# the first solution depends on the order of the productions. A BestFirstAgenda supports the list
+# operations the parsers use (append, +=, pop, len), but pop always returns the item with the best
+# (lowest) score; among items with the same score, the last one added comes first, so with a constant
+# score it behaves exactly like the list. Optionally, a beam width caps the size of the agenda by
+# dropping the worst items (then the search is no longer complete: parses can be lost).
+#     import agenda
+#     question3.parse_with_agenda(G, tokens, agenda=agenda.BestFirstAgenda(agenda.score_input))
+# The scoring functions below (score_input, score_stack, score_derivation, prior_score) work for the
+# items of all these parsers, which share the layout (stack, position, deriv, depth, length, cost);
+# weighted() combines several of them. They are O(1): the parsers keep the sizes and the cost of the
+# derivation so far in the items, updating them from the predecessor when they build an item. The step
+# costs of prior_score reach the parser as the costs attribute of the agenda (taken from the scoring
+# function), and a plain list has none.
+
+import heapq
+import math
+
+
+class BestFirstAgenda:
+
+    def __init__(self, score, beam=None):
+        # score: procedure mapping an agenda item to a number (lower is better)
+        # beam:  optional maximum number of items; when the agenda grows to twice this size,
+        #        it is cut back to the beam best items (so pruning costs O(log n) per item on average)
+        self.score = score
+        self.beam = beam
+        self.costs = getattr(score, "costs", None)   # step costs to add up in the items (see prior_score)
+        self.heap = []
+        self.counter = 0
+        self.dropped = 0      # number of items removed by the beam
+
+    def append(self, item):
+        # (the negated counter makes the latest item win ties, as with list.pop)
+        self.counter += 1
+        heapq.heappush(self.heap, (self.score(item), -self.counter, item))
+        if self.beam is not None and len(self.heap) >= 2 * self.beam:
+            self.prune()
+
+    def __iadd__(self, items):
+        for item in items:
+            self.append(item)
+        return self
+
+    def pop(self):
+        return heapq.heappop(self.heap)[2]
+
+    def __len__(self):
+        return len(self.heap)
+
+    def prune(self):
+        self.dropped += len(self.heap) - self.beam
+        self.heap = heapq.nsmallest(self.beam, self.heap)
+        heapq.heapify(self.heap)
+
+
+# scoring functions for best-first search; lower scores are expanded first
+# (items (stack, position, deriv, depth, length, cost): position is the index of the next input token,
+#  depth the number of symbols on the stack and length the number of steps in deriv)
+def score_input(item):
+    # items that have consumed more of the input first
+    (stack, pos, deriv, depth, length, cost) = item
+    return -pos
+
+
+def score_stack(item):
+    # items with fewer symbols on the stack first (top-down: fewer left to match; shift-reduce: reduce early)
+    (stack, pos, deriv, depth, length, cost) = item
+    return depth
+
+
+def score_derivation(item):
+    # items with shorter derivations first (breadth-first search, if used alone)
+    (stack, pos, deriv, depth, length, cost) = item
+    return length
+
+
+def prior_score(priors):
+    # priors: dict from derivation steps (symbol, number of daughters) to probabilities
+    #         (steps that are not in priors count as probability 1)
+    # returns a scoring function preferring items whose derivation so far is most probable;
+    # its step costs (score.costs) are added up in the items by the parser (see BestFirstAgenda)
+    # (the top-down parsers add the costs of expand and match steps, the shift-reduce parsers
+    #  those of reduce steps)
+    costs = {(arity, X): -math.log(p) for ((X, arity), p) in priors.items()}
+    def score(item):
+        (stack, pos, deriv, depth, length, cost) = item
+        return cost
+    score.costs = costs
+    return score
+
+
+def weighted(*pairs):
+    # combines scoring functions: weighted((1.0, f), (0.5, g)) scores an item with f(item) + 0.5 * g(item)
+    # (the items carry a single cost, so at most one of them can be a prior_score)
+    costs = [f.costs for (weight, f) in pairs if getattr(f, "costs", None) is not None]
+    if len(costs) > 1:
+        raise ValueError("weighted: only one prior scoring function can be combined")
+    def score(item):
+        return sum(weight * f(item) for (weight, f) in pairs)
+    if costs:
+        score.costs = costs[0]
+    return score
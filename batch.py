@@ -0,0 +1,366 @@
+# batch.py
+# course "Parsing"
+
+# Batch parsing of sentence lists with a pool of worker processes.
+# The grammar is loaded once per worker (not once per sentence), the sentences are sent to the
+# workers in chunks, and the results come back in input order, with the step count of each parse.
+# Large corpus files (one sentence per line, optionally gzip'd) are parsed as a stream, with the
+# results written to a JSONL file as they come in:
+#     python batch.py corpus.txt.gz results.jsonl --grammar grammar.cfg --engine cyk
+# The workers get their grammars from the compiled-grammar cache (grammar_cache.py), so only
+# the first run with a new grammar pays for compiling it.
+
+import argparse
+import contextlib
+import gzip
+import io
+import itertools
+import json
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import engines as parsers    # (batch.engines is the table below)
+import grammar_cache
+import parse_utils
+
+
+# ------------------------------------------------------------------
+# engines:
+# for each engine, a procedure that loads the grammar (a CFG string in nltk format) and
+# a procedure that parses a list of tokens with it and returns a pair (number of parses, steps)
+
+def load_cyk(grammar):
+    cyk = parsers.cyk
+    G1, G2, mapping = grammar_cache.cyk_grammar(grammar_cache.load_compiled(grammar))
+    return cyk, G1, G2, cyk.index_grammar(G1, G2)
+
+def parse_cyk(compiled, tokens):
+    (cyk, G1, G2, index) = compiled
+    return cyk.cyk_parse_bitset(G1, G2, tokens, index)
+
+
+def load_recognizer(grammar):
+    cyk = parsers.cyk
+    G1, G2, mapping = grammar_cache.cyk_grammar(grammar_cache.load_compiled(grammar))
+    return cyk, G1, G2, cyk.rule_tensor(G1, G2)
+
+def parse_recognizer(compiled, tokens):
+    # (the recognizer does not count parses or steps: 1 parse stands for "grammatical")
+    (cyk, G1, G2, tensor) = compiled
+    return int(cyk.cyk_recognize(G1, G2, tokens, tensor)), None
+
+
+def load_topdown(grammar):
+    # (on the interned grammar: the agenda holds symbol ids, see grammar.py)
+    question3 = parsers.topdown
+    g = parsers.grammar.load_grammar(grammar)
+    G = g.topdown_view()
+    return question3, g, G, g.lookahead_view(G)
+
+def parse_topdown(compiled, tokens, stats=None):
+    (question3, g, G, table) = compiled
+    counter, sol = question3.parse_with_agenda(G, g.encode(tokens), table, g.start, stats)
+    return sol, counter
+
+def parse_memo(compiled, tokens, stats=None):
+    (question3, g, G, table) = compiled
+    counter, sol = question3.parse_with_memo(G, g.encode(tokens), table, g.start, stats)
+    return sol, counter
+
+
+def load_ll1(grammar):
+    # (ValueError if the grammar is not LL(1), see build_ll1_table in 5_1.py)
+    ll1 = parsers.ll1
+    table = ll1.build_ll1_table(ll1.load_grammar(grammar))
+    return ll1, table
+
+def parse_ll1(compiled, tokens):
+    # (every step is a table lookup or a match, so the steps are the length of the derivation)
+    (ll1, table) = compiled
+    seq = ll1.parse_ll1(table, tokens)
+    if seq is None:
+        return 0, None
+    return 1, len(seq)
+
+
+def load_shift_reduce(grammar):
+    shift_reduce = parsers.shift_reduce
+    g = parsers.grammar.load_grammar(grammar)
+    G = g.shift_reduce_view()
+    return shift_reduce, g, G, shift_reduce.build_reduce_trie(G)
+
+def parse_shift_reduce(compiled, tokens, stats=None):
+    (shift_reduce, g, G, trie) = compiled
+    counter, sol = shift_reduce.parse_with_agenda(G, g.encode(tokens), trie, g.start, stats)
+    return sol, counter
+
+
+def load_earley(grammar):
+    # (on the interned grammar: the chart items hold symbol ids, see grammar.py)
+    earley = parsers.earley
+    g = parsers.grammar.load_grammar(grammar)
+    return earley, g, g.topdown_view()
+
+def parse_earley(compiled, tokens):
+    (earley, g, G) = compiled
+    counter, sol = earley.parse_with_earley(G, g.encode(tokens), g.start)
+    return sol, counter
+
+
+def load_lr(grammar):
+    lr_parser = parsers.lr
+    return lr_parser, lr_parser.build_lr_tables(grammar)
+
+def parse_lr(compiled, tokens):
+    (lr_parser, tables) = compiled
+    counter, sol = lr_parser.parse_with_lr(tables, tokens)
+    return sol, counter
+
+
+def load_glr(grammar):
+    # (ValueError if the grammar has empty rules, see check_tables in glr.py)
+    glr = parsers.glr
+    tables = glr.lr_parser.build_lr_tables(grammar)
+    glr.check_tables(tables)
+    return glr, tables
+
+def parse_glr(compiled, tokens):
+    (glr, tables) = compiled
+    counter, sol = glr.parse_with_glr(tables, tokens)
+    return sol, counter
+
+
+engines = {
+    "cyk": (load_cyk, parse_cyk),                      # bitset CYK (grammar is converted to CNF)
+    "recognize": (load_recognizer, parse_recognizer),  # vectorized CYK recognizer
+    "topdown": (load_topdown, parse_topdown),          # top-down backtracking with lookahead (question3.py)
+    "memo": (load_topdown, parse_memo),                # memoized top-down (question3.py)
+    "ll1": (load_ll1, parse_ll1),                      # LL(1) table-driven parsing (5_1.py)
+    "shift_reduce": (load_shift_reduce, parse_shift_reduce),  # shift-reduce agenda (7_3.py)
+    "earley": (load_earley, parse_earley),
+    "lr": (load_lr, parse_lr),
+    "glr": (load_glr, parse_glr),
+}
+
+# engines whose parse procedure takes an optional parse_stats.ParseStats as third argument
+stats_engines = {"topdown", "memo", "shift_reduce"}
+
+
+# ------------------------------------------------------------------
+# parses one at a time:
+# for each engine that builds parses (all but the recognizer), a procedure that takes the compiled grammar
+# and the tokens and returns a generator yielding the parses as they are found: derivations (lists of
+# arity/symbol pairs) for the agenda parsers, trees for the chart parsers (for cyk, over the CNF grammar).
+# Stopping the generator early skips the rest of the search (see parse_utils.first_parse).
+
+def iter_cyk(compiled, tokens):
+    (cyk, G1, G2, index) = compiled
+    return cyk.iter_parses(G1, G2, tokens)
+
+def iter_topdown(compiled, tokens):
+    (question3, g, G, table) = compiled
+    for deriv in question3.iter_parses(G, g.encode(tokens), table, g.start):
+        yield [(arity, g.symbols[X]) for (arity, X) in deriv]
+
+def iter_memo(compiled, tokens):
+    (question3, g, G, table) = compiled
+    for deriv in question3.iter_memo_parses(G, g.encode(tokens), table, g.start):
+        yield [(arity, g.symbols[X]) for (arity, X) in deriv]
+
+def iter_ll1(compiled, tokens):
+    (ll1, table) = compiled
+    seq = ll1.parse_ll1(table, tokens)
+    if seq is not None:
+        yield seq
+
+def iter_shift_reduce(compiled, tokens):
+    # (reduce steps record the LHS, shift steps the token)
+    (shift_reduce, g, G, trie) = compiled
+    for deriv in shift_reduce.iter_parses(G, g.encode(tokens), trie, g.start):
+        yield [(arity, g.symbols[X]) for (arity, X) in deriv]
+
+def iter_earley(compiled, tokens):
+    # (the trees are built over the symbol ids and relabelled with the symbols)
+    (earley, g, G) = compiled
+    for tree in earley.iter_parses(G, g.encode(tokens), g.start):
+        yield decode_tree(g, tree)
+
+def decode_tree(g, tree):
+    # tree over symbol ids (the leaves are token ids) -> the same tree over the symbols of g
+    return type(tree)(g.symbols[tree.label()],
+                      [g.symbols[child] if type(child) == int else decode_tree(g, child) for child in tree])
+
+def iter_lr(compiled, tokens):
+    (lr_parser, tables) = compiled
+    return lr_parser.iter_parses(tables, tokens)
+
+def iter_glr(compiled, tokens):
+    (glr, tables) = compiled
+    return glr.iter_parses(tables, tokens)
+
+
+iterators = {
+    "cyk": iter_cyk,
+    "topdown": iter_topdown,
+    "memo": iter_memo,
+    "ll1": iter_ll1,
+    "shift_reduce": iter_shift_reduce,
+    "earley": iter_earley,
+    "lr": iter_lr,
+    "glr": iter_glr,
+}
+
+
+def iter_parses(engine, compiled, tokens):
+    # compiled: result of the engine's load procedure (see engines)
+    if engine not in iterators:
+        raise ValueError("engine " + repr(engine) + " does not build parses, choose one of " + ", ".join(iterators))
+    return iterators[engine](compiled, tokens)
+
+
+def has_parse(engine, compiled, tokens):
+    # grammaticality check: stops at the first parse (the recognizer only answers this question anyway)
+    if engine not in iterators:
+        (load, parse) = engines[engine]
+        return parse(compiled, tokens)[0] > 0
+    return parse_utils.has_parse(iter_parses(engine, compiled, tokens))
+
+
+def check_engine(engine):
+    # parse procedure for the workers that only checks grammaticality: (1 or 0 parses, no step count)
+    def check(compiled, tokens):
+        return int(has_parse(engine, compiled, tokens)), None
+    return check
+
+
+# ------------------------------------------------------------------
+# workers:
+
+# state of a worker process (set once by init_worker):
+worker_engine = None
+worker_grammar = None
+
+def init_worker(engine, grammar, first=False):
+    global worker_engine, worker_grammar
+    (load, parse) = engines[engine]
+    worker_engine = check_engine(engine) if first else parse
+    with contextlib.redirect_stdout(io.StringIO()):
+        worker_grammar = load(grammar)
+
+
+def parse_sentence(sentence):
+    # parses one sentence in a worker; the parsers' own progress messages are discarded
+    tokens = sentence.split()
+    with contextlib.redirect_stdout(io.StringIO()):
+        parses, steps = worker_engine(worker_grammar, tokens)
+    return {"sentence": sentence, "tokens": len(tokens), "parses": parses, "steps": steps}
+
+
+def parse_batch(sentences, grammar, engine="cyk", workers=None, chunksize=16, first=False):
+    # sentences: iterable of sentences (strings, tokens separated by spaces)
+    # grammar:   CFG in nltk string format
+    # engine:    name of the parser (see engines)
+    # workers:   number of worker processes (default: one per CPU); with 1, everything runs in this process
+    # chunksize: number of sentences sent to a worker at a time
+    # first:     only check grammaticality, stopping each search at the first parse
+    #            ("parses" is then 1 or 0, and "steps" None)
+
+    # returns a list with a dict for each sentence, in input order:
+    # {"sentence": ..., "tokens": number of tokens, "parses": number of parses, "steps": processing steps}
+
+    if engine not in engines:
+        raise ValueError("unknown engine " + repr(engine) + ", choose one of " + ", ".join(engines))
+    if workers == 1:
+        init_worker(engine, grammar, first)
+        return [parse_sentence(sentence) for sentence in sentences]
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(engine, grammar, first)) as executor:
+        return list(executor.map(parse_sentence, sentences, chunksize=chunksize))
+
+
+# ------------------------------------------------------------------
+# streaming:
+
+def open_text(path, mode):
+    # opens a text file, gzip'd if the name ends in .gz; "-" stands for stdin/stdout
+    if path == "-":
+        return contextlib.nullcontext(sys.stdin if mode == "r" else sys.stdout)
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def read_sentences(path):
+    # generator yielding the sentences of a file (one per line, empty lines are skipped),
+    # without ever holding more than one line in memory
+    with open_text(path, "r") as corpus:
+        for line in corpus:
+            sentence = line.strip()
+            if sentence != "":
+                yield sentence
+
+
+def parse_stream(sentences, grammar, engine="cyk", workers=None, chunksize=16, window=1024, first=False):
+    # like parse_batch, but a generator: sentences can be an arbitrarily long iterator
+    # (e.g. read_sentences), and the results are yielded in input order as soon as they are available.
+    # At most two windows of sentences are in flight at a time (one being parsed, one being handed out),
+    # so the memory use does not grow with the size of the corpus.
+    if engine not in engines:
+        raise ValueError("unknown engine " + repr(engine) + ", choose one of " + ", ".join(engines))
+    sentences = iter(sentences)
+    if workers == 1:
+        init_worker(engine, grammar, first)
+        for sentence in sentences:
+            yield parse_sentence(sentence)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(engine, grammar, first)) as executor:
+        pending = None
+        while True:
+            batch = list(itertools.islice(sentences, window))
+            # submit the next window before handing out the results of the previous one
+            results = executor.map(parse_sentence, batch, chunksize=chunksize) if batch else None
+            if pending is not None:
+                yield from pending
+            if results is None:
+                break
+            pending = results
+
+
+def parse_file(in_path, out_path, grammar, engine="cyk", workers=None, chunksize=16, window=1024, first=False):
+    # parses a corpus file (see read_sentences) and writes one JSON object per sentence to out_path
+    # (JSONL, gzip'd if out_path ends in .gz); returns the number of sentences
+    n = 0
+    with open_text(out_path, "w") as out:
+        for result in parse_stream(read_sentences(in_path), grammar, engine, workers, chunksize, window, first):
+            out.write(json.dumps(result) + "\n")
+            n += 1
+            if n % window == 0:
+                out.flush()
+    return n
+
+
+def main():
+    parser = argparse.ArgumentParser(description="parse a corpus file (one sentence per line) and write JSONL results")
+    parser.add_argument("corpus", help='input file, optionally gzip\'d (.gz); "-" for stdin')
+    parser.add_argument("output", help='output JSONL file, gzip\'d if it ends in .gz; "-" for stdout')
+    parser.add_argument("--grammar", required=True, help="file with a CFG in nltk format")
+    parser.add_argument("--engine", default="cyk", choices=sorted(engines))
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: one per CPU)")
+    parser.add_argument("--chunksize", type=int, default=16)
+    parser.add_argument("--window", type=int, default=1024, help="number of sentences read ahead")
+    parser.add_argument("--first", action="store_true", help="only check grammaticality (stop at the first parse)")
+    args = parser.parse_args()
+    with open(args.grammar, encoding="utf-8") as f:
+        grammar = f.read()
+    # the grammar is loaded here once as well, so that a grammar the engine cannot use
+    # (e.g. one that is not LL(1) for ll1) is reported before the workers start
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            engines[args.engine][0](grammar)
+    except ValueError as error:
+        parser.error(args.engine + ": " + str(error))
+    n = parse_file(args.corpus, args.output, grammar, args.engine, args.workers, args.chunksize, args.window, args.first)
+    print(n, "sentences parsed", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
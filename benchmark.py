@@ -0,0 +1,371 @@
+# benchmark.py
+# course "Parsing"
+
+# Benchmark of the parsing strategies on generated sentences of growing length.
+# For a grammar, sentences of each length are sampled uniformly from all derivations of that length
+# (optionally only sentences with a given range of ambiguity, i.e. number of parses), and every engine
+# of batch.py parses them; for each sentence and engine, the wall time, the steps (the engine's counter),
+# the peak memory (tracemalloc) and the number of parses are recorded, and for the agenda parsers also
+# the maximum agenda size, the dead ends and the memo hits (see parse_stats.py). The results are written as
+# CSV and/or JSON, together with complexity curves fitted to time, steps and agenda size as functions of the length:
+# a power law  y = a * n^k  and an exponential  y = a * b^n  (whichever fits better is the "best" one).
+#     python benchmark.py --grammar pp --lengths 3-15 --engines cyk,earley,glr --csv pp.csv --json pp.json
+#     python benchmark.py --grammar arith --lengths 3-31:2    (LL(1), so the ll1 engine runs as well)
+
+import argparse
+import contextlib
+import csv
+import io
+import json
+import random
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+
+import batch
+import engines as parsers
+from parse_stats import ParseStats
+
+# grammars by name: module with the grammar string, and the name of the string in the module
+grammars = {
+    "pp": ("cyk", "grammar"),            # PP attachment (cyk_skeleton.py), ambiguity grows with the number of PPs
+    "question3": ("topdown", "grammar"), # coordination and PPs (question3.py)
+    "linguistic": ("ll1", "linguistic_grammar"),   # small grammar of 5_1.py
+    "arith": ("ll1", "grammar1"),        # bracketed arithmetic (5_1.py), LL(1) and unambiguous
+}
+
+# engines in the default run (the LL(1) parser only loads LL(1) grammars, like arith;
+# for the other grammars it is skipped, see run_benchmark)
+default_engines = ["topdown", "memo", "ll1", "shift_reduce", "cyk", "earley", "lr", "glr"]
+
+
+def grammar_text(name):
+    # grammar string for a name in grammars (anything else is taken to be a file name)
+    if name in grammars:
+        (module, variable) = grammars[name]
+        return getattr(getattr(parsers, module), variable)
+    with open(name, encoding="utf-8") as f:
+        return f.read()
+
+
+# ------------------------------------------------------------------
+# sentence generation:
+
+def derivation_counts(g):
+    # g: grammar.Grammar
+    # returns a procedure count(X, n): number of derivations of a string of n tokens from symbol X
+    # (symbols can derive the empty string anywhere in a RHS; cycles of unit rules and of
+    #  nullable symbols are cut off, so these are the derivations without repeated unit chains)
+    counts = {}
+
+    def count(X, n):
+        if not g.is_nonterminal(X):
+            return 1 if n == 1 else 0
+        if (X, n) not in counts:
+            counts[(X, n)] = 0        # under construction (cycle of unit rules or nullable symbols)
+            counts[(X, n)] = sum(count_sequence(g.rhs_of(p), n) for p in g.by_lhs[X])
+        return counts[(X, n)]
+
+    def count_sequence(RHS, n):
+        if len(RHS) == 0:
+            return 1 if n == 0 else 0
+        if len(RHS) == 1:
+            return count(RHS[0], n)
+        if (RHS, n) not in counts:
+            # (the first symbol can take from 0 to n tokens, where 0 only counts if it is nullable)
+            counts[(RHS, n)] = sum(count(RHS[0], m) * count_sequence(RHS[1:], n-m) for m in range(0, n+1))
+        return counts[(RHS, n)]
+
+    return count, count_sequence
+
+
+def sample_sentence(g, n, rng, counts):
+    # random sentence of n tokens; every derivation of length n is equally likely
+    (count, count_sequence) = counts
+
+    def choose(options):
+        # options: list of (weight, value)
+        r = rng.randrange(sum(w for (w, v) in options))
+        for (w, v) in options:
+            if r < w:
+                return v
+            r -= w
+
+    def expand(X, n):
+        if not g.is_nonterminal(X):
+            return [X]
+        p = choose([(count_sequence(g.rhs_of(p), n), p) for p in g.by_lhs[X]])
+        return expand_sequence(g.rhs_of(p), n)
+
+    def expand_sequence(RHS, n):
+        if len(RHS) == 0:
+            return []
+        if len(RHS) == 1:
+            return expand(RHS[0], n)
+        m = choose([(count(RHS[0], m) * count_sequence(RHS[1:], n-m), m) for m in range(0, n+1)])
+        return expand(RHS[0], m) + expand_sequence(RHS[1:], n-m)
+
+    if count(g.start, n) == 0:
+        return None
+    return " ".join(g.decode(expand(g.start, n)))
+
+
+def generate_sentences(grammar, lengths, per_length=3, ambiguity=None, seed=0, tries=50):
+    # grammar:    CFG in nltk string format
+    # lengths:    sentence lengths (numbers of tokens)
+    # per_length: number of different sentences per length
+    # ambiguity:  optional pair (min, max) of the number of parses (counted with the Earley parser)
+    # returns a list of (sentence, number of parses); lengths for which the grammar has no sentences are skipped
+    g = parsers.grammar.load_grammar(grammar)
+    counts = derivation_counts(g)
+    rng = random.Random(seed)
+    earley = batch.load_earley(grammar)
+    result = []
+    for n in lengths:
+        found = {}
+        for attempt in range(tries * per_length):
+            if len(found) == per_length:
+                break
+            sentence = sample_sentence(g, n, rng, counts)
+            if sentence is None:
+                break
+            if sentence in found:
+                continue
+            with contextlib.redirect_stdout(io.StringIO()):
+                parses, steps = batch.parse_earley(earley, sentence.split())
+            if ambiguity is None or ambiguity[0] <= parses <= ambiguity[1]:
+                found[sentence] = parses
+        result += list(found.items())
+    return result
+
+
+# ------------------------------------------------------------------
+# measurements:
+
+class OverBudget(Exception):
+    pass
+
+
+@contextlib.contextmanager
+def time_limit(seconds):
+    # raises OverBudget inside the block once it has run for the given number of seconds (None: no limit);
+    # this uses SIGALRM, so it only works on Unix and in the main thread; elsewhere, the block runs to the end
+    if seconds is None or not hasattr(signal, "setitimer") or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def alarm(signum, frame):
+        raise OverBudget()
+
+    previous = signal.signal(signal.SIGALRM, alarm)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def measure(parse, compiled, tokens, memory=True, with_stats=False, budget=None):
+    # runs one parse; returns a dict with parses, steps, seconds and peak_kb (None without memory),
+    # and with with_stats (for batch.stats_engines), max_agenda, dead_ends and dedupe_hits
+    # (the time is taken in a separate run without tracemalloc, which slows down allocations a lot)
+    # budget: each run is stopped after this many seconds; if the timed run is stopped, timed_out is True
+    #         and parses, steps and seconds are None (a stopped memory run only leaves peak_kb None)
+    result = {"parses": None, "steps": None, "seconds": None, "peak_kb": None, "timed_out": False}
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            with time_limit(budget):
+                start = time.perf_counter()
+                parses, steps = parse(compiled, tokens)
+                seconds = time.perf_counter() - start
+        except OverBudget:
+            result["timed_out"] = True
+            return result
+        result.update(parses=parses, steps=steps, seconds=seconds)
+        try:
+            if with_stats:
+                stats = ParseStats(memory)
+                with time_limit(budget):
+                    parse(compiled, tokens, stats)
+                result.update(peak_kb=stats.peak_kb, max_agenda=stats.max_agenda,
+                              dead_ends=stats.dead_ends, dedupe_hits=stats.dedupe_hits)
+            elif memory:
+                tracemalloc.start()
+                with time_limit(budget):
+                    parse(compiled, tokens)
+                result["peak_kb"] = tracemalloc.get_traced_memory()[1] / 1024
+        except OverBudget:
+            pass
+        finally:
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+    return result
+
+
+def accepts(engine, compiled, tokens, budget=None):
+    # grammaticality check of a sampled sentence with batch.has_parse (None if it is stopped by the budget)
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            with time_limit(budget):
+                return batch.has_parse(engine, compiled, tokens)
+        except OverBudget:
+            return None
+
+
+def run_benchmark(grammar, sentences, engine_names=None, budget=2.0, memory=True, name="grammar"):
+    # grammar:   CFG in nltk string format
+    # sentences: list of (sentence, number of parses), e.g. from generate_sentences
+    # budget:    a parse is stopped after this many seconds (see measure), and once an engine takes
+    #            longer than that for a sentence, it is not run on longer sentences (the backtracking
+    #            parsers are exponential); None: no limit
+    # engines that cannot load the grammar (the LL(1) parser for a grammar that is not LL(1)) are skipped,
+    # and so are engines that reject one of the sentences (they are generated by the grammar, so
+    # such an engine is broken and its measurements would be meaningless)
+    # returns a list of rows (dicts), one for each sentence and engine
+    rows = []
+    for engine in engine_names or default_engines:
+        (load, parse) = batch.engines[engine]
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                compiled = load(grammar)
+                load_seconds = time.perf_counter() - start
+        except ValueError as error:
+            print(engine, "skipped:", error, file=sys.stderr)
+            continue
+        print(engine, "loaded in %.3fs" % load_seconds, file=sys.stderr)
+        limit = None
+        for (sentence, ambiguity) in sorted(sentences, key=lambda s: len(s[0].split())):
+            tokens = sentence.split()
+            if limit is not None and len(tokens) > limit:
+                continue
+            row = {"grammar": name, "engine": engine, "length": len(tokens), "ambiguity": ambiguity, "sentence": sentence}
+            row.update(measure(parse, compiled, tokens, memory, engine in batch.stats_engines, budget))
+            if not row["timed_out"] and accepts(engine, compiled, tokens, budget) is False:
+                print(engine, "skipped: rejects the grammatical sentence", repr(sentence), file=sys.stderr)
+                rows = [row for row in rows if row["engine"] != engine]
+                break
+            rows.append(row)
+            if row["timed_out"] or (budget is not None and row["seconds"] > budget):
+                print(engine, "over budget at length", len(tokens), file=sys.stderr)
+                limit = len(tokens)
+    return rows
+
+
+# ------------------------------------------------------------------
+# complexity curves:
+
+def fit_curves(rows, measures=("seconds", "steps", "max_agenda")):
+    # least-squares fits (numpy.polyfit in log space) of each measure against the sentence length, per engine:
+    # - "power":       y = a * n^k  (k = "exponent")
+    # - "exponential": y = a * b^n  (b = "base")
+    # each with the coefficient of determination r2 (in log space); "best" names the better fit
+    import numpy as np    # (only needed for the fits)
+
+    fits = {}
+    for engine in sorted(set(row["engine"] for row in rows)):
+        fits[engine] = {}
+        for measure in measures:
+            points = [(row["length"], row[measure]) for row in rows
+                      if row["engine"] == engine and row.get(measure) is not None and row[measure] > 0]
+            if len(set(n for (n, y) in points)) < 3:
+                continue
+            n = np.array([p[0] for p in points], dtype=float)
+            log_y = np.log(np.array([p[1] for p in points], dtype=float))
+
+            def r2(x, coefficients):
+                residual = log_y - np.polyval(coefficients, x)
+                total = log_y - log_y.mean()
+                return 1.0 - float(residual @ residual) / max(float(total @ total), 1e-12)
+
+            power = np.polyfit(np.log(n), log_y, 1)
+            exponential = np.polyfit(n, log_y, 1)
+            fit = {
+                "power": {"exponent": float(power[0]), "a": float(np.exp(power[1])), "r2": r2(np.log(n), power)},
+                "exponential": {"base": float(np.exp(exponential[0])), "a": float(np.exp(exponential[1])),
+                                "r2": r2(n, exponential)},
+            }
+            fit["best"] = "power" if fit["power"]["r2"] >= fit["exponential"]["r2"] else "exponential"
+            fits[engine][measure] = fit
+    return fits
+
+
+# ------------------------------------------------------------------
+# output:
+
+columns = ["grammar", "engine", "length", "ambiguity", "parses", "steps", "seconds", "timed_out", "peak_kb",
+           "max_agenda", "dead_ends", "dedupe_hits", "sentence"]
+
+def write_csv(rows, path):
+    with batch.open_text(path, "w") as f:
+        writer = csv.DictWriter(f, fieldnames=columns, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def write_json(rows, fits, path):
+    with batch.open_text(path, "w") as f:
+        json.dump({"rows": rows, "fits": fits}, f, indent=1)
+
+
+def print_summary(fits):
+    for engine in fits:
+        for measure in fits[engine]:
+            fit = fits[engine][measure]
+            if fit["best"] == "power":
+                curve = "n^%.2f" % fit["power"]["exponent"]
+            else:
+                curve = "%.2f^n" % fit["exponential"]["base"]
+            print("{:<14}{:<11}~ {:<10} (r2 = {:.3f})".format(engine, measure, curve, fit[fit["best"]]["r2"]))
+
+
+def parse_lengths(text):
+    # "3-15" or "3,5,8" or "3-15:2" (every second length)
+    lengths = []
+    for part in text.split(","):
+        step = 1
+        if ":" in part:
+            part, step = part.split(":")
+        if "-" in part:
+            low, high = part.split("-")
+            lengths += list(range(int(low), int(high)+1, int(step)))
+        else:
+            lengths.append(int(part))
+    return lengths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark the parsers on generated sentences of growing length")
+    parser.add_argument("--grammar", default="pp", help="one of " + ", ".join(grammars) + ", or a file with a CFG in nltk format")
+    parser.add_argument("--lengths", default="3-12", help='sentence lengths, e.g. "3-15", "3,5,8" or "3-21:2"')
+    parser.add_argument("--per-length", type=int, default=3, help="sentences per length")
+    parser.add_argument("--ambiguity", default=None, help='range of the number of parses, e.g. "2-100"')
+    parser.add_argument("--engines", default=",".join(default_engines), help="comma-separated, from: " + ", ".join(batch.engines))
+    parser.add_argument("--budget", type=float, default=2.0, help="seconds per parse before it is stopped (and the engine skips longer sentences)")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc runs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--csv", default=None, help="output CSV file")
+    parser.add_argument("--json", default=None, help="output JSON file (rows and fits)")
+    args = parser.parse_args()
+
+    grammar = grammar_text(args.grammar)
+    ambiguity = None
+    if args.ambiguity is not None:
+        low, high = args.ambiguity.split("-")
+        ambiguity = (int(low), int(high))
+    sentences = generate_sentences(grammar, parse_lengths(args.lengths), args.per_length, ambiguity, args.seed)
+    print(len(sentences), "sentences", file=sys.stderr)
+    rows = run_benchmark(grammar, sentences, args.engines.split(","), args.budget, not args.no_memory, args.grammar)
+    fits = fit_curves(rows)
+    if args.csv is not None:
+        write_csv(rows, args.csv)
+    if args.json is not None:
+        write_json(rows, fits, args.json)
+    print_summary(fits)
+
+
+if __name__ == "__main__":
+    main()
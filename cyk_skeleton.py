@@ -2,13 +2,19 @@
 # Jonas Kuhn, University of Stuttgart, 2020
 # course "Parsing"
 
-from nltk import CFG, Tree
-import matplotlib.pyplot as plt
+import heapq
+import math
 
-trace = True # False # 
+from nltk import CFG, PCFG, Tree
+
+import tracing
+
+trace = tracing.print_events # None #   (subscriber for the parsing events, see tracing.py)
 
 interactive =  True # False #
 
+bitset = True # False #   (use the bitset chart engine cyk_parse_bitset instead of cyk_parse)
+
 # string format used in nltk class: 
 # our test grammar:
 
@@ -26,6 +32,22 @@ N -> 'elephant' | 'elephants' | 'mouse' | 'mice' | 'pajamas' | 'workers' | 'fish
 V -> 'sneezed' | 'giggled' | 'trumpeted' | 'saw' | 'shot' | 'can'
 """
 
+# the same grammar with rule probabilities (nltk PCFG format, see load_pcfg and viterbi_parse):
+pcfg_grammar = """
+S -> NP VP [1.0]
+NP -> DET N [0.5] | DET NP1 [0.15] | 'I' [0.25] | 'workers' [0.05] | 'fish' [0.05]
+NP1 -> N PP [1.0]
+VP -> V NP [0.5] | V VP1 [0.25] | 'sneezed' [0.05] | 'giggled' [0.05] | 'trumpeted' [0.05] |\
+ 'saw' [0.05] | 'shot' [0.05]
+VP1 -> NP PP [1.0]
+PP -> P NP [1.0]
+DET -> 'the' [0.5] | 'an' [0.2] | 'my' [0.2] | 'most' [0.1]
+P -> 'in' [0.5] | 'with' [0.5]
+N -> 'elephant' [0.2] | 'elephants' [0.1] | 'mouse' [0.2] | 'mice' [0.1] | 'pajamas' [0.2] |\
+ 'workers' [0.1] | 'fish' [0.1]
+V -> 'sneezed' [0.1] | 'giggled' [0.1] | 'trumpeted' [0.1] | 'saw' [0.3] | 'shot' [0.3] | 'can' [0.1]
+"""
+
 sentences = [
 "the elephant with my pajamas saw the mouse",
 "workers can fish",
@@ -38,50 +60,295 @@ sentences = [
 # CYK Parsing
 
 # conversion procedure for grammar:
-def load_grammar(grammar):
+def load_grammar(grammar, mapping=None):
     # converts the CFG into an internal representation (checking whether it is in CNF)
+    # rules that are not in CNF are converted with to_cnf (see there);
+    # grammar: CFG in nltk string format, or an nltk CFG (so a caller that has parsed it already
+    #          does not parse it again, see grammar_cache.compile_grammar)
+    # mapping: optional dictionary that is filled with the information needed by debinarize
+    #          to map trees of the converted grammar back to the original nonterminals
 
     G1 = {}       # dictionary for productions of form   A -> a     (keys are RHS)
     G2 = {}       # dictionary for productions of form   A -> B C   (keys are RHS, as a tuple)
     NT = set()
-    cfg = CFG.fromstring(grammar)
+    if isinstance(grammar, CFG):
+        cfg = grammar
+    else:
+        cfg = CFG.fromstring(grammar)
 
     count_CNF_violations = 0
     # first pass: determine what are the non-terminals -> set NT
     for P in cfg.productions():
         LHS = str(P.lhs())
-        NT = NT.union([LHS])
+        NT.add(LHS)
 
-    # second pass: construct two dictionaries, indexing productions by RHS
+    # second pass: collect the rules and check whether they are in CNF
+    rules = []
     for P in cfg.productions():
         LHS = str(P.lhs())
         RHS = []
         for A in P.rhs():
             RHS =  RHS + [str(A)]
-        if len(RHS) == 1:
-            # make sure this is a terminal symbol
-            if RHS[0] not in NT:
-                # add to internal representation
-                if RHS[0] not in G1:
-                    G1[RHS[0]] = []
-                G1[RHS[0]] += [LHS]
-            else:
-                count_CNF_violations += 1
-                print("\n\nERROR: The rule ", LHS, "-->", RHS, " has a single RHS symbol, which is not a terminal symbol!\n\n")
-        elif len(RHS) == 2:
-            if RHS[0] in NT and RHS[1] in NT:
-                if (RHS[0],RHS[1]) not in G2:
-                    G2[(RHS[0],RHS[1])] = [] 
-                G2[(RHS[0],RHS[1])] += [LHS]
-            else:
-                count_CNF_violations += 1
-                print("\n\nERROR: The rule ", LHS, "-->", RHS, " has two RHS symbols, which are not both nonterminal!\n\n")
+        if len(RHS) == 1 and RHS[0] not in NT:
+            pass
+        elif len(RHS) == 2 and RHS[0] in NT and RHS[1] in NT:
+            pass
         else:
             count_CNF_violations += 1
-            print("\n\nERROR: The rule ", LHS, "-->", RHS, " has more than two RHS symbols!\n\n")
+            if trace: trace("not_cnf", lhs=LHS, rhs=RHS)
+        rules += [(LHS, tuple(RHS))]
+
+    if count_CNF_violations > 0:
+        if trace: trace("convert", count=count_CNF_violations)
+        rules = to_cnf(rules, NT, mapping)
+
+    # third pass: construct two dictionaries, indexing productions by RHS
+    for (LHS, RHS) in rules:
+        if len(RHS) == 1:
+            if RHS[0] not in G1:
+                G1[RHS[0]] = []
+            G1[RHS[0]] += [LHS]
+        else:
+            if RHS not in G2:
+                G2[RHS] = [] 
+            G2[RHS] += [LHS]
 
     return G1, G2
 
+def load_pcfg(grammar, mapping=None):
+    # like load_grammar, for a PCFG in nltk string format (every rule with its probability, e.g. NP -> DET N [0.5])
+    # returns G1, G2 as load_grammar and a dictionary with the natural log probability of each rule,
+    # with keys (LHS, RHS tuple); rules that are not in CNF are converted with to_cnf, which converts
+    # their probabilities as well (mapping: as for load_grammar)
+
+    pcfg = PCFG.fromstring(grammar)
+    NT = set()
+    for P in pcfg.productions():
+        NT.add(str(P.lhs()))
+
+    rules = []
+    probs = {}
+    count_CNF_violations = 0
+    for P in pcfg.productions():
+        LHS = str(P.lhs())
+        RHS = tuple([str(A) for A in P.rhs()])
+        if not (len(RHS) == 1 and RHS[0] not in NT) and not (len(RHS) == 2 and RHS[0] in NT and RHS[1] in NT):
+            count_CNF_violations += 1
+        # (a rule listed twice is one rule with the sum of the probabilities)
+        if (LHS, RHS) not in probs:
+            rules += [(LHS, RHS)]
+        probs[(LHS, RHS)] = probs.get((LHS, RHS), 0.0) + P.prob()
+
+    if count_CNF_violations > 0:
+        if trace: trace("convert", count=count_CNF_violations)
+        rules = to_cnf(rules, NT, mapping, probs)
+
+    G1 = {}
+    G2 = {}
+    for (LHS, RHS) in rules:
+        if len(RHS) == 1:
+            G1.setdefault(RHS[0], [])
+            G1[RHS[0]] += [LHS]
+        else:
+            G2.setdefault(RHS, [])
+            G2[RHS] += [LHS]
+    logprobs = {}
+    for rule in rules:
+        logprobs[rule] = math.log(probs[rule]) if probs[rule] > 0 else -math.inf
+    return G1, G2, logprobs
+
+def to_cnf(rules, NT, mapping=None, probs=None):
+    # converts a list of rules (LHS, RHS tuple) into CNF, in the usual four steps:
+    # 1. terminal lifting:   terminals in RHS of length >= 2 are replaced by new nonterminals <a> -> a
+    # 2. binarization:       A -> X1 X2 ... Xn becomes A -> X1 A|<X2-...-Xn>, A|<X2-...-Xn> -> X2 A|<X3-...-Xn>, ...
+    # 3. epsilon handling:   for every nullable symbol in a RHS, a variant of the rule without it is added;
+    #                        empty rules are dropped
+    # 4. unit-rule closure:  if A =>* B by unit rules A -> B, every non-unit rule B -> alpha is copied to A -> alpha,
+    #                        once for every chain of unit rules from A to B (without repeated symbols), so that
+    #                        the parses via different chains are counted as different parses
+    # NT:      set of nonterminals (new nonterminals are added to it)
+    # mapping: if given, filled with
+    #          - mapping["symbols"]: new nonterminal -> original symbol it stands for
+    #          - mapping["chains"]:  (A, RHS) -> list of the chains of unit rules [A, ..., B] that were collapsed
+    #            into A -> RHS, one for each copy of the rule in the result, in the same order ([A] for the
+    #            rule A -> RHS itself); see debinarize
+    #          (subtrees for empty constituents are not restored, and the parses that only differ in them are merged)
+    # probs:   optional dict (LHS, RHS) -> probability for the rules of a PCFG (see load_pcfg); it is
+    #          replaced by the probabilities of the converted rules: new helper rules get probability 1,
+    #          and a rule that stands for several derivations (via empty constituents or unit chains)
+    #          gets the probability of the best one, as needed by viterbi_parse
+    #          (with probs, every rule is kept once, and only the most probable unit chain is recorded)
+
+    symbols = {}
+    chains = {}
+
+    def new_symbol(name, stands_for):
+        while name in NT and name not in symbols:
+            name = name + "'"
+        NT.add(name)
+        symbols[name] = stands_for
+        return name
+
+    # 1. terminal lifting and 2. binarization:
+    binary = []
+    seen = set()
+    weight = {}       # probabilities of the converted rules (only used with probs)
+    def add(rule, p=1.0):
+        # shared helper symbols would otherwise produce the same rule twice (i.e. spurious ambiguity)
+        if rule not in seen:
+            seen.add(rule)
+            binary.append(rule)
+        if probs is not None:
+            weight[rule] = max(weight.get(rule, 0.0), p)
+
+    for (LHS, RHS) in rules:
+        # (the first rule of a binarized chain carries the probability of the original rule)
+        p = probs[(LHS, RHS)] if probs is not None else 1.0
+        if len(RHS) >= 2:
+            lifted = []
+            for A in RHS:
+                if A not in NT:
+                    T = new_symbol("<" + A + ">", A)
+                    add((T, (A,)))
+                    A = T
+                lifted += [A]
+            RHS = tuple(lifted)
+        while len(RHS) > 2:
+            H = new_symbol(LHS.split("|")[0] + "|<" + "-".join(RHS[1:]) + ">", LHS.split("|")[0])
+            add((LHS, (RHS[0], H)), p)
+            p = 1.0
+            LHS, RHS = H, RHS[1:]
+        add((LHS, RHS), p)
+
+    # 3. epsilon handling:
+    nullable = set()
+    changed = True
+    while changed:
+        changed = False
+        for (LHS, RHS) in binary:
+            if LHS not in nullable and all(A in nullable for A in RHS):
+                nullable.add(LHS)
+                changed = True
+    if nullable and trace: trace("nullable", symbols=nullable)
+    if start_symbol in nullable:
+        if trace: trace("empty_string", symbol=start_symbol)
+    # empty[A]: probability of the best derivation of the empty string from A (only with probs)
+    empty = {}
+    changed = probs is not None
+    while changed:
+        changed = False
+        for (LHS, RHS) in binary:
+            if all(A in empty for A in RHS):
+                p = weight[(LHS, RHS)]
+                for A in RHS:
+                    p *= empty[A]
+                if p > empty.get(LHS, 0.0):
+                    empty[LHS] = p
+                    changed = True
+    no_empty = []
+    kept = set()
+    for (LHS, RHS) in binary:
+        # variants of the rule, each with the probability factor for the dropped empty constituent
+        variants = [(RHS, 1.0)]
+        if len(RHS) == 2:
+            if RHS[0] in nullable: variants += [((RHS[1],), empty.get(RHS[0], 1.0))]
+            if RHS[1] in nullable: variants += [((RHS[0],), empty.get(RHS[1], 1.0))]
+        for (V, factor) in variants:
+            if len(V) > 0 and (LHS, V) not in kept:
+                kept.add((LHS, V))
+                no_empty += [(LHS, V)]
+            if len(V) > 0 and probs is not None:
+                weight[(LHS, V)] = max(weight.get((LHS, V), 0.0), weight[(LHS, RHS)] * factor)
+
+    # 4. unit-rule closure:
+    unit = {}
+    for (LHS, RHS) in no_empty:
+        if len(RHS) == 1 and RHS[0] in NT:
+            unit.setdefault(LHS, [])
+            unit[LHS] += [RHS[0]]
+    cnf = [(LHS, RHS) for (LHS, RHS) in no_empty if not (len(RHS) == 1 and RHS[0] in NT)]
+    by_LHS = {}
+    for (LHS, RHS) in cnf:
+        by_LHS.setdefault(LHS, [])
+        by_LHS[LHS] += [RHS]
+    closed = list(cnf)
+    done = set(cnf)
+    base = dict(weight)
+    for A in unit:
+        if probs is None:
+            # all chains A -> ... -> B without repeated symbols, breadth-first (shorter chains first)
+            queue = [[A]]
+            while queue:
+                path = queue.pop(0)
+                for C in unit.get(path[-1], []):
+                    if C not in path:
+                        queue += [path + [C]]
+                        for RHS in by_LHS.get(C, []):
+                            if (A, RHS) not in chains:
+                                chains[(A, RHS)] = [[A]] if (A, RHS) in done else []
+                            closed += [(A, RHS)]
+                            chains[(A, RHS)] += [path + [C]]
+        else:
+            # most probable chains first (Dijkstra's algorithm, with products of probabilities as path lengths)
+            best = {A: 1.0}
+            paths = {A: [A]}
+            heap = [(-1.0, A)]
+            settled = set()
+            while heap:
+                (p, B) = heapq.heappop(heap)
+                if B in settled:
+                    continue
+                settled.add(B)
+                for C in unit.get(B, []):
+                    p = best[B] * base[(B, (C,))]
+                    if p > best.get(C, 0.0):
+                        best[C] = p
+                        paths[C] = paths[B] + [C]
+                        heapq.heappush(heap, (-p, C))
+                if B == A:
+                    continue
+                for RHS in by_LHS.get(B, []):
+                    p = best[B] * base[(B, RHS)]
+                    if (A, RHS) not in done:
+                        done.add((A, RHS))
+                        closed += [(A, RHS)]
+                    elif p <= weight[(A, RHS)]:
+                        continue
+                    weight[(A, RHS)] = p
+                    chains[(A, RHS)] = [paths[B]]
+
+    if mapping is not None:
+        mapping["symbols"] = symbols
+        mapping["chains"] = chains
+    if probs is not None:
+        probs.clear()
+        for rule in closed:
+            probs[rule] = weight[rule]
+    return closed
+
+def debinarize(tree, mapping):
+    # maps a tree over the CNF grammar (as built by to_cnf) back to the original nonterminals:
+    # collapsed unit chains are expanded again, nodes for new nonterminals are removed
+    # and their daughters are attached to the mother
+    # (for a rule with several unit chains, the node's attribute variant, set by ParseForest,
+    #  tells which copy of the rule, i.e. which chain, was used; default: the first one)
+    return restore_nodes(tree, mapping)[0]
+
+def restore_nodes(tree, mapping):
+    # returns the list of nodes that replaces tree in its mother
+    if type(tree) == str:
+        return [tree]
+    RHS = tuple([D if type(D) == str else D.label() for D in tree])
+    nodes = []
+    for D in tree:
+        nodes += restore_nodes(D, mapping)
+    chains = mapping["chains"].get((tree.label(), RHS), [[tree.label()]])
+    chain = chains[getattr(tree, "variant", 0)]
+    for A in reversed(chain):
+        if A not in mapping["symbols"]:
+            nodes = [Tree(A, nodes)]
+    return nodes
+
 def collect_trees(pointers,NT,i,j):
     # reads out the trees in a chart, following the backpointers
     # returns a list of tree representations that can be displays using nltk method
@@ -93,10 +360,14 @@ def collect_trees(pointers,NT,i,j):
         if type(L) == str:        # for terminals, the value of the pointer is the string of the terminal
             return [Tree(NT,[L])]
         else:
-            if trace: print("going through list", L)
+            if trace: trace("pointers", symbol=NT, i=i, j=j, pointers=L)
                                   # for productions of form A -> B C, the value of the pointer is a list of 
                                   # pairs for the two table entries that were put together
-            for (Bpointer,Cpointer) in L:
+            for analysis in L:
+                if type(analysis) == str:    # (another analysis of a lexical entry, see lexical_pointer)
+                    parses += [Tree(NT,[analysis])]
+                    continue
+                (Bpointer,Cpointer) = analysis
                 (BNT,(Bi,Bj)) = Bpointer
                 (CNT,(Ci,Cj)) = Cpointer
                 # make recursive calls to the collect_trees procedure to find the embedded trees for B and C:
@@ -110,9 +381,114 @@ def collect_trees(pointers,NT,i,j):
             return parses
                 
 
-def cyk_parse(G1, G2, tokens):
+class ParseForest:
+    # shared packed parse forest over the backpointers of a CYK chart
+    # (pointers in the format built by cyk_parse, see there)
+    # - every (NT,(i,j)) entry is stored once and shared by all trees that contain it
+    # - the number of trees is computed in polynomial time (one count per entry)
+    # - trees are produced lazily, one at a time, in the same order as collect_trees
+    # - an analysis that occurs several times in the list of an entry (the same rule via different
+    #   unit chains, see to_cnf) gives a tree for each occurrence; the k-th occurrence gets the
+    #   attribute variant = k, so that debinarize can restore the right chain
+
+    def __init__(self, pointers, NT, i, j):
+        self.pointers = pointers
+        self.root = (NT,(i,j))
+        self.counts = {}
+
+    def count(self, key=None):
+        # number of distinct trees below the entry key (default: the root)
+        if key is None:
+            key = self.root
+        if key not in self.counts:
+            if key not in self.pointers:
+                self.counts[key] = 0
+            elif type(self.pointers[key]) == str:
+                self.counts[key] = 1
+            else:
+                total = 0
+                for analysis in self.pointers[key]:
+                    if type(analysis) == str:
+                        total += 1
+                    else:
+                        total += self.count(analysis[0]) * self.count(analysis[1])
+                self.counts[key] = total
+        return self.counts[key]
+
+    def analyses(self, key):
+        # the analyses of an entry as triples (analysis, variant, number of trees)
+        L = self.pointers[key]
+        if type(L) == str:
+            return [(L, 0, 1)]
+        result = []
+        seen = {}
+        for analysis in L:
+            variant = seen.get(analysis, 0)
+            seen[analysis] = variant + 1
+            if type(analysis) == str:
+                result += [(analysis, variant, 1)]
+            else:
+                result += [(analysis, variant, self.count(analysis[0]) * self.count(analysis[1]))]
+        return result
+
+    def node(self, NT, daughters, variant):
+        tree = Tree(NT, daughters)
+        if variant > 0:
+            tree.variant = variant
+        return tree
+
+    def trees(self, key=None):
+        # generator yielding the trees below the entry key (default: the root)
+        if key is None:
+            key = self.root
+        if key not in self.pointers:
+            return
+        (NT,(i,j)) = key
+        for (analysis, variant, n) in self.analyses(key):
+            if type(analysis) == str:
+                yield self.node(NT, [analysis], variant)
+            else:
+                (Bpointer,Cpointer) = analysis
+                for B in self.trees(Bpointer):
+                    for C in self.trees(Cpointer):
+                        yield self.node(NT, [B,C], variant)
+
+    def tree(self, k, key=None):
+        # the k-th tree (counting from 0, in the order of trees()), built without the others
+        if key is None:
+            key = self.root
+        if k < 0 or k >= self.count(key):
+            raise IndexError("no tree " + str(k) + " for " + str(key))
+        (NT,(i,j)) = key
+        for (analysis, variant, n) in self.analyses(key):
+            if k < n:
+                if type(analysis) == str:
+                    return self.node(NT, [analysis], variant)
+                (Bpointer,Cpointer) = analysis
+                n_C = self.count(Cpointer)
+                return self.node(NT, [self.tree(k // n_C, Bpointer), self.tree(k % n_C, Cpointer)], variant)
+            k -= n
+
+
+def lexical_pointer(pointers, key, token):
+    # records a lexical analysis of the entry key (a terminal pointer; a list of them if the
+    # lexical rule occurs several times, see to_cnf)
+    if key not in pointers:
+        pointers[key] = token
+    elif type(pointers[key]) == str:
+        pointers[key] = [pointers[key], token]
+    else:
+        pointers[key] += [token]
+
+
+def cyk_parse(G1, G2, tokens, count_only=False, mapping=None, pointers=None):
     # G1, G2: internal Python dictionary representations of the two types of productions
     # tokens: list of terminal symbols to be parsed
+    # count_only: if True, no backpointers are stored and no trees are extracted;
+    #             the number of parses comes from the derivation counts propagated through the chart
+    # mapping: filled by load_grammar for converted grammars; displayed trees are mapped back with debinarize
+    # pointers: optional empty dict that receives the backpointers (see below), so that the caller can
+    #           read out the trees itself (see iter_parses); no trees are displayed then
 
     # returns a pair of integers: 
     # - the number of distinct parse trees for the input and 
@@ -122,18 +498,31 @@ def cyk_parse(G1, G2, tokens):
     # builds the CYK table, extracts all parse trees and displays them with an nltk method.
 
 
+    show_trees = interactive and pointers is None
+
+    # the empty input has no parse: the CNF grammar has no empty rules (see to_cnf)
+    if len(tokens) == 0:
+        return 0, 0
+
     # use two dictionaries for CYK data structures:
     table = {}       # the CYK table itself
                      # - indexed by a pair of integers for the beginning and end string positions, e.g. (0, 2)
                      # - each value is a list of nonterminals symbols (i.e. simple python strings), e.g. ['VP','V']
                      #   (these are alternative nonterminals covering the substring referred to by this table cell)
-    pointers = {}    # backpointers for retrieving the parse trees afterwards
+    pointers = {} if pointers is None else pointers
+                     # backpointers for retrieving the parse trees afterwards
                      # - indexed by a nested tuple, e.g. ('N', (1, 2)) for a nonterminal in a particular table cell
                      # - the value can be one of two things:
                      #   (a) a single terminal (e.g., 'elephant') [for the entries in table cells (n, n+1)]
                      #   (b) a list of pairs of backpointers [for the B and C entries that were used to build an A]
                      #       for example, the value at key ('NP', (0, 2)) could be the list: 
                      #                    [(('DET', (0, 1)), ('N', (1, 2)))]
+                     #   a pair (or a terminal) occurs once for every copy of the rule in the grammar
+                     #   (see to_cnf: the same rule via different unit chains), e.g. ['a', 'a'] for
+                     #   an entry with two lexical analyses
+    counts = {}      # number of derivations for each entry (same keys as pointers), e.g. counts[('NP', (0, 2))] = 1
+                     # - filled bottom-up while the table is built, so the number of parses is
+                     #   available in O(n^3 |G|) without any tree objects (python ints do not overflow)
 
     # for complexity profiling:
     counter = 0
@@ -147,29 +536,35 @@ def cyk_parse(G1, G2, tokens):
             for LHS in G1[tokens[i]]:
                 table[(i,i+1)] += [LHS]
                 counter += 1
-                if (LHS,(i,i+1)) not in pointers:
-                    pointers[(LHS,(i,i+1))] = tokens[i]
+                counts[(LHS,(i,i+1))] = counts.get((LHS,(i,i+1)), 0) + 1
+                if not count_only:
+                    lexical_pointer(pointers, (LHS,(i,i+1)), tokens[i])
         else:
-            print("Warning -- unknown token:",tokens[i])
+            if trace: trace("unknown", token=tokens[i])
 
     for j in range(2, len(tokens)+1):                                                                  # ***
-        if trace: print("j:",j)
+        if trace: trace("column", j=j)
         for i in range(j-2, -1, -1):                                                              # ***
-            if trace: print("   i:",i)
+            if trace: trace("row", i=i)
             if (i,j) not in table:
                 # initialize list for this dictionary entry:
                 table[(i,j)] = []
 
             for k in range(i+1, j):                                                          # ***
-                if trace: print("     k:",k)
-                if trace: print("          ",i,k,j)
+                if trace: trace("split", i=i, k=k, j=j)
                 for (B,C) in G2:
                     if B in table[(i,k)] and C in table[(k,j)]:
-                        if trace: print("           found",B,C,":",G2[(B,C)])
+                        if trace: trace("found", left=B, right=C, lhs=G2[(B,C)])
                         # append all LHS symbols to table cell (the value of G2[(B,C)] is a list of NT symbols)
                         table[(i,j)] += G2[(B,C)]    
+                        n_derivs = counts[(B,(i,k))] * counts[(C,(k,j))]
                         # add backpointers 
                         for LHS in G2[(B,C)]:
+                            counts[(LHS,(i,j))] = counts.get((LHS,(i,j)), 0) + n_derivs
+                            if count_only:
+                                # for complexity profiling:
+                                counter += 1
+                                continue
                             if (LHS,(i,j)) not in pointers:
                                 # initialize list for this dictionary entry:
                                 pointers[(LHS,(i,j))] = []
@@ -180,24 +575,393 @@ def cyk_parse(G1, G2, tokens):
                             # for complexity profiling:
                             counter += 1
 
-    if trace: print("table:", table)
-    if trace: print("pointers:",pointers)
+    if trace: trace("chart", table=table, pointers=pointers)
 
-    parses = []
-    if start_symbol in table[(0,len(tokens))]:
+    num_parses = 0
+    if count_only:
+        num_parses = counts.get((start_symbol,(0,len(tokens))), 0)
+        if interactive: print(counter,' steps taken.')
+        if interactive: print(num_parses, "solutions")
+
+    elif start_symbol in table[(0,len(tokens))]:
         if interactive: print("success!")
 
-        # trigger extraction of trees from chart
-        parses = collect_trees(pointers,start_symbol,0,len(tokens))
+        # packed forest over the chart: counting does not build any trees,
+        # and the trees are only extracted (one by one) when they are displayed
+        forest = ParseForest(pointers,start_symbol,0,len(tokens))
+        num_parses = forest.count()
 
         if interactive: print(counter,' steps taken.')
-        if interactive: print(len(parses), "solutions")
-        if interactive: 
-            for tree in parses: 
+        if interactive: print(num_parses, "solutions")
+        if show_trees:
+            for tree in forest.trees(): 
+                if mapping: tree = debinarize(tree, mapping)
                 print(tree)
                 tree.draw()
 
-    return len(parses), counter
+    return num_parses, counter
+
+
+def iter_parses(G1, G2, tokens, mapping=None):
+    # generator yielding the parse trees one at a time (mapped back with debinarize if mapping is given):
+    # the chart is complete before the first one, but the trees are read out of the packed forest
+    # only as they are asked for, so a caller that stops early does not pay for enumerating all of them
+    # (for a grammaticality check that does not even store backpointers, see cyk_recognize)
+    pointers = {}
+    num_parses, counter = cyk_parse(G1, G2, tokens, pointers=pointers)
+    if num_parses > 0:
+        for tree in ParseForest(pointers,start_symbol,0,len(tokens)).trees():
+            if mapping: tree = debinarize(tree, mapping)
+            yield tree
+
+
+# ------------------------------------------------------------------
+# Bitset CYK
+
+# the same algorithm as cyk_parse, but on an integer-based chart:
+# - every nonterminal is interned to an integer id
+# - every table cell is a bitset (a python int with bit A set iff A covers the substring)
+# - binary rules are indexed by their left daughter, so for a split point k only the
+#   rules whose B is actually present in cell (i,k) are tried
+
+def index_grammar(G1, G2):
+    # converts G1, G2 (as returned by load_grammar) into an integer-based index
+
+    # intern nonterminals (the order of first appearance is kept, so ids are reproducible):
+    ids = {}
+    names = []
+    for LHS_list in list(G1.values()) + list(G2.values()):
+        for A in LHS_list:
+            if A not in ids:
+                ids[A] = len(names)
+                names += [A]
+    for (B,C) in G2:
+        for A in (B,C):
+            if A not in ids:
+                ids[A] = len(names)
+                names += [A]
+
+    # lexicon: terminal -> list of LHS ids (duplicates are kept, they count as distinct derivations)
+    lexicon = {}
+    for a in G1:
+        lexicon[a] = [ids[A] for A in G1[a]]
+
+    # binary rules indexed by left daughter: by_left[B] is a list of triples (C, mask, LHS ids),
+    # where mask is the bitset of all LHS symbols, used to fill the table cell in one step
+    by_left = [[] for A in names]
+    for (B,C) in G2:
+        LHS_ids = [ids[A] for A in G2[(B,C)]]
+        mask = 0
+        for A in LHS_ids:
+            mask |= 1 << A
+        by_left[ids[B]] += [(ids[C], mask, LHS_ids)]
+
+    return {"ids": ids, "names": names, "lexicon": lexicon, "by_left": by_left}
+
+
+def bits(cell):
+    # yields the ids of the nonterminals in a bitset, lowest id first
+    while cell:
+        low = cell & -cell
+        yield low.bit_length() - 1
+        cell ^= low
+
+
+def cyk_parse_bitset(G1, G2, tokens, index=None, mapping=None):
+    # G1, G2: internal Python dictionary representations of the two types of productions
+    # tokens: list of terminal symbols to be parsed
+    # index:  result of index_grammar(G1, G2); built on the fly if not given
+    #         (pass it in when parsing many sentences with the same grammar)
+    # mapping: filled by load_grammar for converted grammars; displayed trees are mapped back with debinarize
+
+    # returns the same pair of integers as cyk_parse:
+    # - the number of distinct parse trees for the input and
+    # - the number of processing steps (rule applications) it took to find all solutions
+
+    if index is None:
+        index = index_grammar(G1, G2)
+    names = index["names"]
+    lexicon = index["lexicon"]
+    by_left = index["by_left"]
+
+    n = len(tokens)
+    # table[i][j] is the bitset for cell (i,j);
+    # counts[i][j] maps a nonterminal id to the number of its derivations over (i,j),
+    # so the number of parse trees is available without extracting them
+    table = [[0] * (n+1) for i in range(n+1)]
+    counts = [[None] * (n+1) for i in range(n+1)]
+    # backpointers in the format of cyk_parse are only needed for displaying the trees:
+    pointers = {}
+
+    # for complexity profiling:
+    counter = 0
+
+    for i in range(n):
+        cell = 0
+        cell_counts = {}
+        if tokens[i] in lexicon:
+            for A in lexicon[tokens[i]]:
+                cell |= 1 << A
+                cell_counts[A] = cell_counts.get(A, 0) + 1
+                counter += 1
+                if interactive:
+                    lexical_pointer(pointers, (names[A],(i,i+1)), tokens[i])
+        else:
+            if trace: trace("unknown", token=tokens[i])
+        table[i][i+1] = cell
+        counts[i][i+1] = cell_counts
+
+    for j in range(2, n+1):
+        for i in range(j-2, -1, -1):
+            cell = 0
+            cell_counts = {}
+            for k in range(i+1, j):
+                left = table[i][k]
+                right = table[k][j]
+                if not left or not right:
+                    continue
+                left_counts = counts[i][k]
+                right_counts = counts[k][j]
+                for B in bits(left):
+                    for (C, mask, LHS_ids) in by_left[B]:
+                        if (right >> C) & 1:
+                            cell |= mask
+                            n_derivs = left_counts[B] * right_counts[C]
+                            for A in LHS_ids:
+                                cell_counts[A] = cell_counts.get(A, 0) + n_derivs
+                                # for complexity profiling:
+                                counter += 1
+                                if interactive:
+                                    pointers.setdefault((names[A],(i,j)), [])
+                                    pointers[(names[A],(i,j))] += [((names[B],(i,k)),(names[C],(k,j)))]
+            table[i][j] = cell
+            counts[i][j] = cell_counts
+            if trace and cell: trace("cell", i=i, j=j, symbols=[names[A] for A in bits(cell)])
+
+    num_parses = 0
+    if n > 0 and start_symbol in index["ids"]:
+        num_parses = counts[0][n].get(index["ids"][start_symbol], 0)
+
+    if num_parses > 0:
+        if interactive: print("success!")
+        if interactive: print(counter,' steps taken.')
+        if interactive: print(num_parses, "solutions")
+        if interactive:
+            for tree in ParseForest(pointers,start_symbol,0,n).trees():
+                if mapping: tree = debinarize(tree, mapping)
+                print(tree)
+                tree.draw()
+
+    return num_parses, counter
+
+# ------------------------------------------------------------------
+# Vectorized CYK recognizer
+
+# for recognition only (is the input grammatical?), no backpointers are needed:
+# the chart is a dense boolean numpy array chart[i, j, A] and all cells of one span
+# length are computed at once, with one array operation over the list of binary rules
+
+def rule_tensor(G1, G2):
+    # converts G1, G2 into the arrays used by cyk_recognize:
+    # - "lexicon": terminal -> boolean row over nonterminals
+    # - "left", "right": the B and C of every binary rule A -> B C, sorted by A
+    # - "lhs":     the distinct A's, and "groups": the index of the first rule of each of them
+    #              (so that the rules of one A are left[groups[g]:groups[g+1]])
+    # (a cell costs O(|rules|) per split point, not O(|NT|^3) as with a dense |NT| x |NT|^2 tensor)
+    import numpy as np    # (only needed for the vectorized recognizer)
+    index = index_grammar(G1, G2)
+    size = len(index["names"])
+
+    lexicon = {}
+    for a in index["lexicon"]:
+        row = np.zeros(size, dtype=bool)
+        row[index["lexicon"][a]] = True
+        lexicon[a] = row
+
+    ids = index["ids"]
+    rules = sorted((ids[A], ids[B], ids[C]) for (B,C) in G2 for A in G2[(B,C)])
+    lhs = [A for (A, B, C) in rules]
+    groups = [r for r in range(len(rules)) if r == 0 or lhs[r] != lhs[r-1]]
+
+    return {"ids": ids, "lexicon": lexicon,
+            "left": np.array([B for (A, B, C) in rules], dtype=np.intp),
+            "right": np.array([C for (A, B, C) in rules], dtype=np.intp),
+            "lhs": np.array([lhs[r] for r in groups], dtype=np.intp),
+            "groups": np.array(groups, dtype=np.intp)}
+
+
+def cyk_recognize(G1, G2, tokens, tensor=None):
+    # G1, G2: internal Python dictionary representations of the two types of productions
+    # tokens: list of terminal symbols to be parsed
+    # tensor: result of rule_tensor(G1, G2); built on the fly if not given
+
+    # returns True iff the start symbol covers the whole input
+
+    import numpy as np
+    if tensor is None:
+        tensor = rule_tensor(G1, G2)
+    ids = tensor["ids"]
+    lexicon = tensor["lexicon"]
+    size = len(ids)
+
+    n = len(tokens)
+    if n == 0 or start_symbol not in ids:
+        return False
+
+    chart = np.zeros((n+1, n+1, size), dtype=bool)
+    for i in range(n):
+        if tokens[i] not in lexicon:
+            if trace: trace("unknown", token=tokens[i])
+            return False
+        chart[i, i+1] = lexicon[tokens[i]]
+    if len(tensor["lhs"]) == 0:
+        return bool(n == 1 and chart[0, 1, ids[start_symbol]])
+
+    for length in range(2, n+1):
+        # all cells (i, i+length) with all their split points k = i+d at once:
+        starts = np.arange(0, n-length+1)
+        splits = np.arange(1, length)
+        I = starts[:, None]
+        K = starts[:, None] + splits[None, :]
+        J = I + length
+        left = chart[I, K]        # cells (i,k): [cell, split, B]
+        right = chart[K, J]       # cells (k,j): [cell, split, C]
+        # every rule A -> B C applies where its B and its C are present at the same split point:
+        applies = (left[:, :, tensor["left"]] & right[:, :, tensor["right"]]).any(axis=1)     # [cell, rule]
+        # and an A is found if any of its rules applies:
+        found = np.logical_or.reduceat(applies, tensor["groups"], axis=1)                       # [cell, A]
+        chart[starts, starts+length, tensor["lhs"][:, None]] = found.T
+        if trace: trace("span", length=length)
+
+    return bool(chart[0, n, ids[start_symbol]])
+
+
+# ------------------------------------------------------------------
+# Viterbi CYK for PCFGs
+
+# instead of all parses, only the most probable one is computed: every chart entry (i, j, A) keeps
+# the best log probability of an A over tokens i..j and a single backpointer (rule and split point)
+# to the analysis that reached it, so finding the best parse takes O(n^3 |G|) steps and one read-out,
+# however many parses there are. The chart consists of numpy arrays, and as in cyk_recognize all
+# cells of one span length are computed at once.
+
+def pcfg_tables(G1, G2, logprobs):
+    # converts G1, G2 and the log probabilities (as returned by load_pcfg) into the arrays used by viterbi_parse:
+    # - "lexicon": terminal -> float row over nonterminals with the log probabilities of the rules A -> a
+    #              (-inf where there is no such rule)
+    # - "left", "right", "lhs", "logprob": one entry for every binary rule A -> B C
+    # - "by_lhs":  the rule numbers grouped by LHS, as a matrix [A, slot] padded with the number of
+    #              rules (a dummy rule that never applies), so the best rule for each A is one argmax
+    import numpy as np    # (only needed for the Viterbi parser)
+    index = index_grammar(G1, G2)
+    ids = index["ids"]
+    size = len(index["names"])
+
+    lexicon = {}
+    for a in G1:
+        row = np.full(size, -np.inf)
+        for A in G1[a]:
+            row[ids[A]] = logprobs[(A, (a,))]
+        lexicon[a] = row
+
+    left = []
+    right = []
+    lhs = []
+    logprob = []
+    groups = [[] for A in range(size)]
+    for (B,C) in G2:
+        for A in dict.fromkeys(G2[(B,C)]):
+            groups[ids[A]] += [len(lhs)]
+            left += [ids[B]]
+            right += [ids[C]]
+            lhs += [ids[A]]
+            logprob += [logprobs[(A, (B,C))]]
+    by_lhs = np.full((size, max([len(g) for g in groups] + [1])), len(lhs), dtype=np.intp)
+    for A in range(size):
+        by_lhs[A, :len(groups[A])] = groups[A]
+
+    return {"ids": ids, "names": index["names"], "lexicon": lexicon,
+            "left": np.array(left, dtype=np.intp), "right": np.array(right, dtype=np.intp),
+            "lhs": np.array(lhs, dtype=np.intp), "logprob": np.array(logprob), "by_lhs": by_lhs}
+
+
+def viterbi_parse(G1, G2, logprobs, tokens, tables=None, mapping=None):
+    # G1, G2, logprobs: grammar as returned by load_pcfg
+    # tokens: list of terminal symbols to be parsed
+    # tables: result of pcfg_tables(G1, G2, logprobs); built on the fly if not given
+    # mapping: filled by load_pcfg for converted grammars; the tree is mapped back with debinarize
+
+    # returns a pair:
+    # - the natural log probability of the most probable parse (-inf if there is no parse) and
+    # - that parse tree (None if there is no parse)
+
+    import numpy as np
+    if tables is None:
+        tables = pcfg_tables(G1, G2, logprobs)
+    ids = tables["ids"]
+    names = tables["names"]
+    lexicon = tables["lexicon"]
+    left = tables["left"]
+    right = tables["right"]
+    by_lhs = tables["by_lhs"]
+    size = len(names)
+
+    n = len(tokens)
+    if n == 0 or start_symbol not in ids:
+        return -math.inf, None
+
+    best = np.full((n+1, n+1, size), -np.inf)          # best[i, j, A]: best log probability of A over i..j
+    rule = np.full((n+1, n+1, size), -1, dtype=np.intp) # rule A -> B C of that analysis (-1: lexical or none)
+    split = np.zeros((n+1, n+1, size), dtype=np.intp)   # its split point k
+    for i in range(n):
+        if tokens[i] not in lexicon:
+            if trace: trace("unknown", token=tokens[i])
+            return -math.inf, None
+        best[i, i+1] = lexicon[tokens[i]]
+
+    for length in range(2, n+1):
+        starts = np.arange(0, n-length+1)
+        splits = np.arange(1, length)
+        I = starts[:, None]
+        K = starts[:, None] + splits[None, :]
+        J = I + length
+        # score of every rule at every split point of every cell: [cell, split, rule]
+        scores = best[I, K][:, :, left] + best[K, J][:, :, right] + tables["logprob"]
+        # the best split point for each rule ...
+        k_best = scores.argmax(axis=1)
+        rule_best = np.take_along_axis(scores, k_best[:, None, :], axis=1)[:, 0, :]
+        # ... and the best rule for each LHS (the dummy rule at the end scores -inf)
+        padded = np.concatenate([rule_best, np.full((len(starts), 1), -np.inf)], axis=1)[:, by_lhs]
+        slot = padded.argmax(axis=2)
+        cell_best = np.take_along_axis(padded, slot[:, :, None], axis=2)[:, :, 0]
+        r = by_lhs[np.arange(size)[None, :], slot]
+        k = np.concatenate([k_best, np.zeros((len(starts), 1), dtype=np.intp)], axis=1)
+        k = np.take_along_axis(k, r, axis=1)
+        best[starts, starts+length] = cell_best
+        rule[starts, starts+length] = np.where(cell_best > -np.inf, r, -1)
+        split[starts, starts+length] = starts[:, None] + 1 + k
+        if trace: trace("span", length=length)
+
+    score = float(best[0, n, ids[start_symbol]])
+    if score == -math.inf:
+        return score, None
+
+    def build(i, j, A):
+        # reads out the tree of entry (i, j, A), following the backpointers
+        if rule[i, j, A] < 0:
+            return Tree(names[A], [tokens[i]])
+        r = rule[i, j, A]
+        k = split[i, j, A]
+        return Tree(names[A], [build(i, k, left[r]), build(k, j, right[r])])
+
+    tree = build(0, n, ids[start_symbol])
+    if mapping: tree = debinarize(tree, mapping)
+    if interactive:
+        print("best parse (log probability", score, "):")
+        print(tree)
+        tree.draw()
+    return score, tree
+
 
 # ---------------------------------------------------------
 
@@ -206,7 +970,10 @@ def demo():
         # prompt user for sentences; these are parsed with the CYK parser
 
 
-        G1, G2 =  load_grammar(grammar)
+        mapping = {}
+        G1, G2 =  load_grammar(grammar, mapping)
+        pcfg_mapping = {}
+        P1, P2, logprobs = load_pcfg(pcfg_grammar, pcfg_mapping)
 
         print("Grammar (CYK):\n",G1,G2)
         print("-------------------------------------------------\n")
@@ -220,13 +987,19 @@ def demo():
                 tokens = sentence.split() 
 
                 print("CYK:")
-                cyk_parse(G1, G2, tokens)
+                if bitset:
+                    cyk_parse_bitset(G1, G2, tokens, mapping=mapping)
+                else:
+                    cyk_parse(G1, G2, tokens, mapping=mapping)
+                print("Viterbi:")
+                viterbi_parse(P1, P2, logprobs, tokens, mapping=pcfg_mapping)
 
     else:
         # run a batch of sentences through the top-down backtracking and the CYK parser
         # string lengths and number of steps are collected and plotted in a scatter plot
 
         G1, G2 =  load_grammar(grammar)
+        index = index_grammar(G1, G2)
 
         # initialize lists for recording sentence length (xs) vs. steps taken (ys):
         cky_xs = []
@@ -236,13 +1009,25 @@ def demo():
             print('parsing sentence "',s,'"...')
             tokens = s.split()
 
-            cky_nsol, cky_nsteps = cyk_parse(G1, G2, tokens)
+            if bitset:
+                cky_nsol, cky_nsteps = cyk_parse_bitset(G1, G2, tokens, index)
+            else:
+                cky_nsol, cky_nsteps = cyk_parse(G1, G2, tokens, count_only=True)
             print("   cky:",cky_nsol,"solutions",len(tokens),"tokens, ",cky_nsteps,"steps")
             if cky_nsol > 0:
                 cky_xs += [len(tokens)]
                 cky_ys += [cky_nsteps]
 
+        # the most probable parse of each sentence, with the PCFG version of the grammar:
+        P1, P2, logprobs = load_pcfg(pcfg_grammar)
+        tables = pcfg_tables(P1, P2, logprobs)
+        for s in sentences:
+            score, tree = viterbi_parse(P1, P2, logprobs, s.split(), tables)
+            print('best parse of "',s,'": log probability',score)
+            print("   ",tree)
+
         # display profiling plot:
+        import matplotlib.pyplot as plt    # (only needed for the plot)
         plt.scatter(cky_xs,cky_ys, c='b')
 
         # put values for another parser in the same plot:
@@ -250,4 +1035,6 @@ def demo():
 
         plt.show()
 
-demo()
+
+if __name__ == "__main__":
+    demo()
@@ -0,0 +1,277 @@
+# earley.py
+# course "Parsing"
+
+# Earley chart parser for arbitrary context-free grammars (including left recursion).
+# The chart is packed: every item is stored once per chart position, together with all the
+# ways it was built, so the number of parses is read off in polynomial time.
+
+from nltk import CFG, Tree
+
+import tracing
+
+trace = tracing.print_events  # None   (subscriber for the parsing events, see tracing.py)
+interactive = False
+
+start_symbol = "S"
+
+# string format used in nltk class:
+# our test grammar (with left recursion):
+
+grammar_left_recursion = """
+S -> NP VP
+NP -> NP N |DET N | DET N PP | 'I'
+VP -> V | V NP | V NP PP
+PP -> P NP
+DET -> 'the' | 'an' | 'my' | 'most'
+P -> 'in'
+N -> 'elephant' | 'elephants' | 'mouse' | 'mice' | 'pajamas' | 'fish' | 'factory' | 'worker'
+V -> 'sneezed' | 'giggled' | 'trumpeted' | 'saw' | 'shot'
+"""
+
+sentences = [
+"I shot the elephant in my pajamas",
+"I shot elephant in my pajamas",
+"the elephant saw a mouse",
+"saw the elephant a mouse",
+"I saw the fish factory worker"
+]
+
+
+# conversion procedure for grammar (same format as in question3.py):
+def load_grammar(grammar):
+    G = {}
+    cfg = CFG.fromstring(grammar)
+    for p in cfg.productions():
+        p = p.__str__().split()
+        for i in range(len(p)):
+            p[i] = p[i].strip("'")
+        G.setdefault(p[0], [])
+        right = p[2:]
+        right.reverse()
+        G[p[0]].append(right)
+    return G
+
+
+def earley_grammar(G):
+    # converts the grammar into the format used by the Earley parser:
+    # a dict with a list of (not reversed) RHS tuples for each non-terminal
+    # G can be
+    # - the output of load_grammar above / in question3.py (lists of reversed RHS's for each non-terminal)
+    # - the output of load_grammar in 7_2.py / 7_3.py (RHS tuples as keys, lists of LHS's as values)
+    # - an nltk CFG
+    E = {}
+    if isinstance(G, CFG):
+        for P in G.productions():
+            E.setdefault(str(P.lhs()), [])
+            E[str(P.lhs())] += [tuple(str(A) for A in P.rhs())]
+    else:
+        for key in G:
+            if type(key) == tuple:
+                for LHS in G[key]:
+                    E.setdefault(LHS, [])
+                    E[LHS] += [key]
+            else:
+                E.setdefault(key, [])
+                for RRHS in G[key]:
+                    E[key] += [tuple(reversed(RRHS))]
+    return E
+
+
+# ------------------------------------------------------------------
+# main procedure:
+def build_chart(E, tokens, start=None):
+    # E:      grammar in the format of earley_grammar
+    # tokens: list of input tokens
+    # start:  start symbol (default: start_symbol; the symbols can be of any type, e.g. the ints of
+    #         grammar.Grammar.topdown_view, with the tokens encoded by grammar.Grammar.encode)
+    # (rules with an empty RHS are allowed: a non-terminal that is completed without consuming input
+    # is recorded in empty, so that items waiting for it at the same position are advanced as well,
+    # also those added after the completion; see Aycock and Horspool 2002)
+
+    # returns the packed chart and the number of processing steps:
+    # - chart[j] is a dict with an entry for each item (LHS, RHS, dot, origin) that ends at position j
+    # - the value is the set of ways the item was built, as pairs (k, child):
+    #   the item with the dot one position further left ends at k, and child covers (k, j);
+    #   child is either a token or a completed item (a tuple, which is in chart[j])
+    #   (a dict with the pairs as keys, i.e. a set that keeps the order in which they were found)
+
+    n = len(tokens)
+    chart = [{} for j in range(n+1)]
+    # waiting[j][B]: the items in chart[j] whose next symbol is B (the items that a completed B advances)
+    waiting = [{} for j in range(n+1)]
+    # for complexity profiling:
+    counter = 0
+
+    def add(j, item, backpointer, agenda):
+        if item not in chart[j]:
+            chart[j][item] = {}
+            agenda += [item]
+            (LHS, RHS, dot, origin) = item
+            if dot < len(RHS):
+                waiting[j].setdefault(RHS[dot], [])
+                waiting[j][RHS[dot]].append(item)
+        if backpointer is not None:
+            chart[j][item][backpointer] = None
+
+    if start is None:
+        start = start_symbol
+    agenda = []
+    for RHS in E.get(start, []):
+        add(0, (start, RHS, 0, 0), None, agenda)
+
+    for j in range(n+1):
+        if j > 0:
+            agenda = list(chart[j])
+        predicted = set()
+        # empty[B]: the completed items of B that start and end at j
+        empty = {}
+        while len(agenda) > 0:
+            item = agenda.pop()
+            counter += 1
+            (LHS, RHS, dot, origin) = item
+            if trace: trace("state", lhs=LHS, rhs=RHS, dot=dot, origin=origin, end=j)
+
+            if dot < len(RHS) and RHS[dot] in E:
+                # predict
+                B = RHS[dot]
+                if B not in predicted:
+                    predicted.add(B)
+                    for RHS_B in E[B]:
+                        add(j, (B, RHS_B, 0, j), None, agenda)
+                # B may already have been completed without consuming input
+                for child in empty.get(B, []):
+                    add(j, (LHS, RHS, dot+1, origin), (j, child), agenda)
+
+            elif dot < len(RHS):
+                # scan
+                if j < n and RHS[dot] == tokens[j]:
+                    add(j+1, (LHS, RHS, dot+1, origin), (j, tokens[j]), [])
+
+            else:
+                # complete (if origin == j, the items that are added to chart[j] later are advanced
+                # when they are processed, see predict)
+                if origin == j:
+                    empty.setdefault(LHS, [])
+                    empty[LHS] += [item]
+                for (W_LHS, W_RHS, W_dot, W_origin) in list(waiting[origin].get(LHS, [])):
+                    add(j, (W_LHS, W_RHS, W_dot+1, W_origin), (origin, item), agenda)
+
+    return chart, counter
+
+
+def count_derivations(chart, item, j, counts):
+    # number of ways to build item ending at j (memoized in counts)
+    if (item, j) not in counts:
+        counts[(item, j)] = 0      # guards against unit cycles
+        if item[2] == 0:
+            total = 1
+        else:
+            (LHS, RHS, dot, origin) = item
+            total = 0
+            for (k, child) in chart[j][item]:
+                prev = (LHS, RHS, dot-1, origin)
+                if type(child) != tuple:
+                    total += count_derivations(chart, prev, k, counts)
+                else:
+                    total += count_derivations(chart, prev, k, counts) * count_derivations(chart, child, j, counts)
+        counts[(item, j)] = total
+    return counts[(item, j)]
+
+
+def complete_parses(chart, n, start=None):
+    # the completed items for the start symbol (default: start_symbol) that span the whole input
+    if start is None:
+        start = start_symbol
+    return [item for item in chart[n] if item[0] == start and item[2] == len(item[1]) and item[3] == 0]
+
+
+def trees(chart, item, j, path=frozenset()):
+    # generator yielding the trees for a completed item ending at j, one at a time
+    # path: the completed items (with their ends) above this one in the tree; a child that is already
+    # on the path is left out, which guards against unit cycles (as in count_derivations)
+    path = path | {(item, j)}
+    for daughters in daughter_lists(chart, item, j, path):
+        yield Tree(item[0], daughters)
+
+
+def daughter_lists(chart, item, j, path):
+    (LHS, RHS, dot, origin) = item
+    if dot == 0:
+        yield []
+    else:
+        for (k, child) in chart[j][item]:
+            if type(child) == tuple and (child, j) in path:
+                continue
+            for left in daughter_lists(chart, (LHS, RHS, dot-1, origin), k, path):
+                if type(child) != tuple:
+                    yield left + [child]
+                else:
+                    for subtree in trees(chart, child, j, path):
+                        yield left + [subtree]
+
+
+def parse_with_earley(G, tokens, start=None):
+    # G:      grammar in any of the formats accepted by earley_grammar
+    # tokens: list of input tokens
+    # start:  start symbol (default: start_symbol), see build_chart
+
+    # returns the same pair as parse_with_agenda in question3.py / 7_3.py,
+    # so it can be passed to parse_batch_with_agenda there:
+    # - the number of processing steps and
+    # - the number of solutions
+
+    if trace: trace("parse", tokens=tokens)
+    E = earley_grammar(G)
+    chart, counter = build_chart(E, tokens, start)
+
+    counts = {}
+    sol = 0
+    for item in complete_parses(chart, len(tokens), start):
+        sol += count_derivations(chart, item, len(tokens), counts)
+
+    if trace: trace("solutions", count=sol)
+    if interactive:
+        for item in complete_parses(chart, len(tokens), start):
+            for tree in trees(chart, item, len(tokens)):
+                print(tree)
+                tree.draw()
+    return counter, sol
+
+
+def iter_parses(G, tokens, start=None):
+    # generator yielding the parse trees one at a time: the chart has to be complete before the first
+    # one (use recognize if no tree is needed), but each tree is only read out of the completed items
+    # when it is asked for, so stopping early skips the (possibly exponential) read-out of the others
+    if trace: trace("parse", tokens=tokens)
+    chart, counter = build_chart(earley_grammar(G), tokens, start)
+    for item in complete_parses(chart, len(tokens), start):
+        yield from trees(chart, item, len(tokens))
+
+
+def recognize(G, tokens, start=None):
+    # grammaticality check: only builds the chart (no trees)
+    chart, counter = build_chart(earley_grammar(G), tokens, start)
+    return complete_parses(chart, len(tokens), start) != []
+
+
+def demo():
+    G = load_grammar(grammar_left_recursion)
+    print("Grammar:\n", G)
+    print("-------------------------------------------------\n")
+    if interactive:
+        while True:
+            sentence = input('Type sentence ("q" to quit): ')
+            if sentence == 'q':
+                break
+            else:
+                tokens = sentence.split()
+                parse_with_earley(G, tokens)
+    else:
+        for sentence in sentences:
+            tokens = sentence.split()
+            counter, sol = parse_with_earley(G, tokens)
+            print('"' + sentence + '":', sol, "solutions,", counter, "steps")
+
+
+if __name__ == "__main__":
+    demo()
@@ -0,0 +1,49 @@
+# engines.py
+# course "Parsing"
+
+# Headless access to the parsers, e.g. for batch workers:
+#     import engines
+#     G1, G2 = engines.cyk.load_grammar(grammar)
+#     engines.cyk.cyk_parse_bitset(G1, G2, tokens)
+# A parser module is only imported when it is first used, with tracing and interactive display
+# switched off, so importing this module costs nothing, and no demo is run, no plot library is
+# loaded and no tree is drawn (matplotlib and numpy are only imported by the procedures that need them).
+
+import importlib
+
+modules = {
+    "cyk": "cyk_skeleton",      # CYK parsers and recognizer
+    "ll1": "5_1",               # LL(1) tables
+    "topdown": "question3",     # top-down backtracking (with lookahead and memoization)
+    "shift_reduce": "7_3",      # shift-reduce agenda
+    "earley": "earley",
+    "lr": "lr_parser",
+    "glr": "glr",
+    "grammar": "grammar",
+    "grammar_cache": "grammar_cache",
+}
+
+
+def quiet_module(name):
+    # imports a parser module with tracing (trace = None, see tracing.py) and interactive display
+    # switched off (also in the parser modules it uses itself, like lr_parser in glr)
+    module = importlib.import_module(name)
+    for used in [module] + [M for M in vars(module).values() if getattr(M, "__name__", None) in modules.values()]:
+        if hasattr(used, "trace"):
+            used.trace = None
+        if hasattr(used, "interactive"):
+            used.interactive = False
+    return module
+
+
+def __getattr__(name):
+    # (called for names that are not defined yet, see PEP 562)
+    if name not in modules:
+        raise AttributeError("module 'engines' has no attribute " + repr(name))
+    module = quiet_module(modules[name])
+    globals()[name] = module
+    return module
+
+
+def __dir__():
+    return sorted(list(globals()) + list(modules))
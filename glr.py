@@ -0,0 +1,249 @@
+# glr.py
+# course "Parsing"
+
+# Generalized LR parsing (Tomita-style) on the tables of lr_parser.py.
+# Instead of copying whole stacks for every alternative, all stacks are merged into one
+# graph-structured stack (GSS), and all parses are collected in a shared packed parse
+# forest (SPPF), so ambiguity costs merged nodes rather than copied stacks.
+# (rules with an empty RHS are not supported: their reductions would need the nullable handling of
+#  RNGLR parsing, so build_forest refuses such tables with a ValueError, see check_tables)
+
+from nltk import Tree
+
+import lr_parser
+import tracing
+
+trace = tracing.print_events  # None   (subscriber for the parsing events, see tracing.py)
+interactive = False
+
+# the PP-attachment grammar from cyk_skeleton.py:
+grammar = """
+S -> NP VP
+NP -> DET N | DET NP1 | 'I' | 'workers' | 'fish'
+NP1 -> N PP
+VP -> V NP | V VP1 | 'sneezed' | 'giggled' | 'trumpeted' | 'saw' | 'shot'
+VP1 -> NP PP
+PP -> P NP
+DET -> 'the' | 'an' | 'my' | 'most'
+P -> 'in' | 'with'
+N -> 'elephant' | 'elephants' | 'mouse' | 'mice' | 'pajamas' | 'workers' | 'fish'
+V -> 'sneezed' | 'giggled' | 'trumpeted' | 'saw' | 'shot' | 'can'
+"""
+
+sentences = [
+"the elephant with my pajamas saw the mouse",
+"workers can fish",
+"I shot an elephant in my pajamas",
+"I shot an elephant in my pajamas with the mouse in my pajamas",
+"I shot an elephant in my pajamas with the mouse in my pajamas with the fish in my pajamas"
+]
+
+
+def check_tables(tables):
+    # raises ValueError if the grammar of the tables has a rule with an empty RHS
+    # (build_forest would miss the reductions through the empty constituents and lose parses)
+    empty = [LHS for (LHS, RHS) in tables["productions"] if len(RHS) == 0]
+    if len(empty) > 0:
+        raise ValueError("GLR: rules with an empty RHS are not supported: " + ", ".join(LHS + " ->" for LHS in empty))
+
+
+# ------------------------------------------------------------------
+# main procedure:
+def build_forest(tables, tokens):
+    # tables: result of lr_parser.build_lr_tables
+    # tokens: list of input tokens
+
+    # returns a triple (forest, root, counter):
+    # - forest: dict mapping each forest node (symbol, i, j) to its list of packed alternatives,
+    #           pairs (production, daughters) where daughters is a tuple of forest nodes
+    #           (a terminal node (token, i, i+1) has no entry)
+    # - root:   the forest node (S, 0, n) for the complete parses (None if the input is rejected)
+    # - counter: number of processing steps (shifts and reductions along GSS paths)
+
+    # (ValueError for a grammar with empty rules, see check_tables)
+
+    # the GSS nodes of one level (input position) are identified by their LR state: a node is a pair (state, level);
+    # edges[node] maps each predecessor node to the forest node for the symbol between them
+
+    check_tables(tables)
+    productions = tables["productions"]
+    action = tables["action"]
+    goto = tables["goto"]
+
+    forest = {}
+    edges = {}
+    counter = 0
+
+    def paths(node, length):
+        # all GSS paths of the given length from node: pairs (end node, forest nodes along the path, left to right)
+        if length == 0:
+            yield node, ()
+        else:
+            for (pred, label) in list(edges[node].items()):
+                for (end, labels) in paths(pred, length-1):
+                    yield end, labels + (label,)
+
+    frontier = {0: (0, 0)}
+    edges[(0, 0)] = {}
+    for i in range(len(tokens)+1):
+        a = tokens[i] if i < len(tokens) else lr_parser.end_marker
+        if trace: trace("frontier", pos=i, tops=sorted(frontier), next=a)
+
+        # reducer: worklist of (node, production, first edge or None for all paths)
+        worklist = []
+        for state in frontier:
+            for act in action.get((state, a), []):
+                if act[0] == "reduce":
+                    worklist.append((frontier[state], act[1], None))
+        while worklist:
+            (node, p, first) = worklist.pop()
+            (LHS, RHS) = productions[p]
+            if first is None:
+                found = paths(node, len(RHS))
+            else:
+                found = [(end, labels + (first[1],)) for (end, labels) in paths(first[0], len(RHS)-1)]
+            for (end, daughters) in found:
+                counter += 1
+                label = (LHS, end[1], i)
+                forest.setdefault(label, [])
+                if (p, daughters) not in forest[label]:
+                    forest[label].append((p, daughters))
+                state = goto[(end[0], LHS)]
+                if state in frontier:
+                    target = frontier[state]
+                    if end in edges[target]:
+                        # the stacks merge here: the new analysis is just another packed alternative of label
+                        continue
+                    edges[target][end] = label
+                    # reductions through the new edge (for a new node, they are found below)
+                    for act in action.get((state, a), []):
+                        if act[0] == "reduce" and len(productions[act[1]][1]) > 0:
+                            worklist.append((target, act[1], (end, label)))
+                else:
+                    target = (state, i)
+                    frontier[state] = target
+                    edges[target] = {end: label}
+                    for act in action.get((state, a), []):
+                        if act[0] == "reduce":
+                            worklist.append((target, act[1], None))
+
+        if i == len(tokens):
+            break
+
+        # shifter:
+        shifted = {}
+        for state in frontier:
+            for act in action.get((state, a), []):
+                if act[0] == "shift":
+                    counter += 1
+                    target = (act[1], i+1)
+                    shifted[act[1]] = target
+                    edges.setdefault(target, {})
+                    edges[target][frontier[state]] = (a, i, i+1)
+        frontier = shifted
+        if frontier == {}:
+            if trace: trace("backtrack", reason="no stack can shift " + str(a))
+            return forest, None, counter
+
+    root = None
+    for state in frontier:
+        if ("accept",) in action.get((state, lr_parser.end_marker), []):
+            for label in edges[frontier[state]].values():
+                root = label
+    return forest, root, counter
+
+
+def count_trees(forest, node, counts):
+    # number of trees below a forest node (memoized in counts)
+    if node not in forest:
+        return 1
+    if node not in counts:
+        counts[node] = 0      # guards against cycles of unit rules
+        total = 0
+        for (p, daughters) in forest[node]:
+            n = 1
+            for D in daughters:
+                n *= count_trees(forest, D, counts)
+            total += n
+        counts[node] = total
+    return counts[node]
+
+
+def trees(forest, node):
+    # generator yielding the trees below a forest node, one at a time
+    if node not in forest:
+        yield node[0]
+    else:
+        for (p, daughters) in forest[node]:
+            for subtrees in daughter_trees(forest, daughters):
+                yield Tree(node[0], subtrees)
+
+
+def daughter_trees(forest, daughters):
+    if len(daughters) == 0:
+        yield []
+    else:
+        for first in trees(forest, daughters[0]):
+            for rest in daughter_trees(forest, daughters[1:]):
+                yield [first] + rest
+
+
+def parse_with_glr(tables, tokens):
+    # tables: result of lr_parser.build_lr_tables
+    # tokens: list of input tokens
+
+    # returns the same pair as parse_with_agenda in 7_3.py, so it can be passed to parse_batch_with_agenda:
+    # - the number of processing steps and
+    # - the number of solutions
+
+    if trace: trace("parse", tokens=tokens, method="GLR")
+    forest, root, counter = build_forest(tables, tokens)
+    sol = 0
+    if root is not None:
+        sol = count_trees(forest, root, {})
+    if trace: trace("solutions", count=sol, nodes=len(forest))
+    if interactive and root is not None:
+        for tree in trees(forest, root):
+            print(tree)
+            tree.draw()
+    return counter, sol
+
+
+def iter_parses(tables, tokens):
+    # generator yielding the parse trees one at a time: the graph-structured stack runs to the end of
+    # the input before the first one (use recognize if no tree is needed), but each tree is only
+    # unpacked from the shared forest when it is asked for
+    if trace: trace("parse", tokens=tokens, method="GLR")
+    forest, root, counter = build_forest(tables, tokens)
+    if root is not None:
+        yield from trees(forest, root)
+
+
+def recognize(tables, tokens):
+    # grammaticality check: only builds the forest (no trees)
+    forest, root, counter = build_forest(tables, tokens)
+    return root is not None
+
+
+def demo():
+    lr_parser.trace = None
+    tables = lr_parser.build_lr_tables(grammar)
+    print(len(tables["states"]), "states,", len(tables["conflicts"]), "conflicts")
+    if interactive:
+        while True:
+            sentence = input('Type sentence ("q" to quit): ')
+            if sentence == 'q':
+                break
+            else:
+                tokens = sentence.split()
+                parse_with_glr(tables, tokens)
+    else:
+        for sentence in sentences:
+            tokens = sentence.split()
+            print('"' + sentence + '":')
+            print("   GLR:", parse_with_glr(tables, tokens))
+            print("   LR with forking:", lr_parser.parse_with_lr(tables, tokens))
+
+
+if __name__ == "__main__":
+    demo()
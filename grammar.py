@@ -0,0 +1,110 @@
+# grammar.py
+# course "Parsing"
+
+# One interned grammar representation for the agenda parsers (top-down and shift-reduce).
+# The symbols are interned to small ints (0, 1, 2, ... in order of first occurrence), and the
+# productions are stored in flat int arrays:
+#     production p:  lhs[p] -> rhs[offsets[p]:offsets[p+1]]
+# The indexes that the different parsers need are built once, as dicts from symbol ids (or RHS
+# tuples) to lists of production numbers:
+# - by_lhs:   productions of a non-terminal (top-down expansion)
+# - by_rhs:   productions with a given RHS (shift-reduce reduction)
+# The views convert the grammar into the dict formats of the parsers, with ints instead of strings,
+# so that their main loops compare and hash small ints instead of strings:
+#     g = grammar.load_grammar(question3.grammar)
+#     G = g.topdown_view()
+#     question3.parse_with_agenda(G, g.encode(tokens), g.lookahead_view(G), g.start)
+# (the arrays come from grammar_cache, i.e. they are memory-mapped from the compiled grammar file)
+# The Earley parser runs on the topdown_view as well (see load_earley in batch.py). LR, GLR and LL(1)
+# do not use it: their main loops already look up small ints (states) in tables that are built once
+# per grammar, so interning would only speed up the table construction. The CYK parsers intern the
+# symbols of the CNF grammar themselves (see index_grammar in cyk_skeleton.py). There are no indexes
+# by first or last RHS symbol, since no parser looks productions up that way: Earley predicts by LHS,
+# the shift-reduce parsers find reductions through the reduce trie (built from the RHS's), and the
+# CYK parsers index the binary CNF rules, not these productions, by their left daughter.
+
+import array
+
+import grammar_cache
+
+unknown = -1    # id of tokens that are not terminals of the grammar (they match nothing)
+
+
+class Grammar:
+
+    def __init__(self, compiled):
+        # compiled: compiled grammar, see grammar_cache.load_compiled (with the start symbol)
+        self.symbols = list(compiled["symbols"])
+        self.ids = {X: i for (i, X) in enumerate(self.symbols)}
+        self.lhs = compiled["lhs"]
+        self.offsets = compiled["rhs_offsets"]
+        self.rhs = compiled["rhs"]
+        self.start = compiled["start"]
+        self.lookahead_offsets = compiled["lookahead_offsets"]
+        self.lookahead = compiled["lookahead"]
+        # (the CNF helper symbols of the compiled grammar are not non-terminals of this grammar)
+        self.nonterminal = array.array("b", [0]) * len(self.symbols)
+        for A in self.lhs:
+            self.nonterminal[A] = 1
+
+        self.by_lhs = {}
+        self.by_rhs = {}
+        for p in range(len(self.lhs)):
+            RHS = self.rhs_of(p)
+            self.by_lhs.setdefault(self.lhs[p], [])
+            self.by_lhs[self.lhs[p]].append(p)
+            self.by_rhs.setdefault(RHS, [])
+            self.by_rhs[RHS].append(p)
+
+    def __len__(self):
+        # number of productions
+        return len(self.lhs)
+
+    def rhs_of(self, p):
+        # RHS of production p, as a tuple of ids
+        return tuple(self.rhs[self.offsets[p]:self.offsets[p+1]])
+
+    def is_nonterminal(self, X):
+        return X != unknown and self.nonterminal[X] == 1
+
+    def encode(self, tokens):
+        # list of tokens -> list of ids (unknown for tokens that are not in the grammar)
+        ids = self.ids
+        return [ids.get(token, unknown) for token in tokens]
+
+    def decode(self, ids):
+        # list of ids -> list of symbols
+        return [self.symbols[X] if X != unknown else None for X in ids]
+
+    # views in the formats of the parsers (with ids instead of strings):
+
+    def topdown_view(self):
+        # format of load_grammar in question3.py / 5_2.py: dict with list of reversed rhs's for each
+        # non-terminal (in reversed order, so the first production ends up at the top of the agenda)
+        return {A: [list(reversed(self.rhs_of(p))) for p in reversed(self.by_lhs[A])] for A in self.by_lhs}
+
+    def shift_reduce_view(self):
+        # format of load_grammar in 7_2.py / 7_3.py: dict from RHS tuples to lists of LHS's
+        return {RHS: [self.lhs[p] for p in self.by_rhs[RHS]] for RHS in self.by_rhs}
+
+    def lookahead_view(self, G):
+        # G: the topdown_view
+        # format of lookahead_table in parse_utils.py (table[A][token]: the productions of G[A], in the
+        # same order, that can start with token), from the lookahead sets stored in the compiled grammar
+        offsets = self.lookahead_offsets.tolist()
+        lookahead = self.lookahead.tolist()
+        table = {}
+        for A in G:
+            table[A] = {}
+            for (p, Prod) in zip(reversed(self.by_lhs[A]), G[A]):
+                for token in lookahead[offsets[p]:offsets[p+1]]:
+                    table[A].setdefault(token, [])
+                    table[A][token].append(Prod)
+        return table
+
+
+def load_grammar(grammar, start="S"):
+    # grammar: CFG in nltk string format
+    # start: start symbol (ValueError if the grammar has no productions for it)
+    # returns the Grammar (compiled once and then read from the grammar cache, see grammar_cache.py)
+    return Grammar(grammar_cache.load_compiled(grammar, start))
@@ -0,0 +1,213 @@
+# grammar_cache.py
+# course "Parsing"
+
+# Compiled grammars, cached on disk.
+# Compiling a grammar (nltk CFG.fromstring, re-stringifying every production, CNF conversion)
+# dominates the start-up time of short-lived parsing workers for large lexicons. Here a grammar
+# is compiled once into a compact binary format:
+# - an interned symbol table (every symbol is a small int)
+# - the productions as flat int32 arrays (LHS, RHS offsets, RHS symbols)
+# - the CNF tables used by the CYK parsers (lexical pairs and binary triples)
+# - the lookahead set of each production (from FIRST and FOLLOW, for the top-down parsers)
+# The file is keyed by a hash of the format version, the start symbol and the grammar text, and
+# later runs memory-map it instead of compiling again (so nltk's CFG.fromstring, the CNF conversion
+# and the FIRST/FOLLOW computation are skipped; the parser modules still import nltk for their trees).
+# cyk_grammar rebuilds the CYK tables from the arrays, grammar.Grammar interns the productions
+# and rebuilds the lookahead tables of the top-down parsers.
+# The first (cold) run with a grammar pays for compiling and writing it, which costs about twice as much
+# as loading it for a single parser: with a 50k-word lexicon, 2.5s against 1.3s for cyk_skeleton.load_grammar
+# (nltk parses the grammar once for both; the extra time goes into the symbol table, the lookahead sets
+# and the file). Later (warm) runs do not load in milliseconds, as was the goal: mapping the file takes
+# about 0.2s (decoding the JSON header with the symbol table), cyk_grammar another 0.2-0.3s and a
+# grammar.Grammar with its views about 0.5-0.8s, because the string table and the dict indexes are rebuilt
+# in Python on every load. That is still 3-5 times faster than compiling, so the cache pays off from the
+# second process that loads the grammar (e.g. the second batch worker), but getting to milliseconds would
+# need the string table and the indexes (by_lhs, by_rhs, the CNF tables) stored as offset arrays in the
+# file and read lazily.
+
+import array
+import hashlib
+import json
+import mmap
+import os
+import struct
+
+import parse_utils
+
+version = 4
+magic = b"PGC4"
+cache_dir = os.environ.get("PARSING_GRAMMAR_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "parsing_project"))
+
+array_names = ["lhs", "rhs_offsets", "rhs", "lexical", "binary", "lookahead_offsets", "lookahead"]
+
+# marker for the end of the input in the FOLLOW sets (distinct from every symbol id, and from
+# grammar.unknown = -1, the id of tokens that are not in the grammar)
+end_marker = -2
+
+
+# ------------------------------------------------------------------
+# compilation:
+
+def compile_grammar(grammar, start="S"):
+    # grammar: CFG in nltk string format
+    # start: start symbol (ValueError if the grammar has no productions for it)
+    # returns the compiled grammar: a dict with the symbol table ("symbols", a list of strings;
+    # "nonterminals", a list of ids; "start"), the CNF back-mapping ("mapping", see cyk_skeleton.to_cnf)
+    # and the int arrays listed in array_names:
+    # - production p: lhs[p] -> rhs[rhs_offsets[p]:rhs_offsets[p+1]]
+    # - lexical: pairs (terminal, A) for the CNF rules A -> terminal
+    # - binary:  triples (B, C, A) for the CNF rules A -> B C
+    # - lookahead: the tokens that production p can start with, lookahead[lookahead_offsets[p]:lookahead_offsets[p+1]]
+    #   (see parse_utils.lookahead_table)
+    from nltk import CFG
+    import cyk_skeleton
+
+    cfg = CFG.fromstring(grammar)
+    ids = {}
+    symbols = []
+
+    def intern(X):
+        if X not in ids:
+            ids[X] = len(symbols)
+            symbols.append(X)
+        return ids[X]
+
+    lhs = array.array("i")
+    rhs_offsets = array.array("i", [0])
+    rhs = array.array("i")
+    for P in cfg.productions():
+        lhs.append(intern(str(P.lhs())))
+        for X in P.rhs():
+            rhs.append(intern(str(X)))
+        rhs_offsets.append(len(rhs))
+    nonterminals = set(lhs)
+    if start not in ids or ids[start] not in nonterminals:
+        raise ValueError("start symbol " + repr(start) + " has no productions in the grammar")
+
+    # lookahead sets (the end of the input is never looked up, so its marker is left out):
+    productions = [(lhs[p], rhs[rhs_offsets[p]:rhs_offsets[p+1]]) for p in range(len(lhs))]
+    nullable, first, follow = parse_utils.first_follow_sets(productions, ids[start], end_marker)
+    lookahead_offsets = array.array("i", [0])
+    lookahead = array.array("i")
+    for (A, RHS) in productions:
+        tokens = parse_utils.first_of_sequence(RHS, nonterminals, nullable, first)
+        if all(X in nullable for X in RHS):
+            tokens = tokens | follow[A]
+        lookahead.extend(sorted(tokens - {end_marker}))
+        lookahead_offsets.append(len(lookahead))
+
+    # CNF tables (the CNF conversion may add new non-terminals to the symbol table):
+    trace = cyk_skeleton.trace
+    cyk_skeleton.trace = None
+    mapping = {}
+    try:
+        G1, G2 = cyk_skeleton.load_grammar(cfg, mapping)
+    finally:
+        cyk_skeleton.trace = trace
+    lexical = array.array("i")
+    for a in G1:
+        for A in G1[a]:
+            lexical.extend([intern(a), intern(A)])
+    binary = array.array("i")
+    for (B, C) in G2:
+        for A in G2[(B, C)]:
+            binary.extend([intern(B), intern(C), intern(A)])
+
+    return {
+        "symbols": symbols,
+        "nonterminals": sorted(nonterminals | set(ids[A] for A in mapping.get("symbols", {}))),
+        "start": ids[start],
+        "mapping": {"symbols": mapping["symbols"],
+                    "chains": [[A, list(RHS), chain] for ((A, RHS), chain) in mapping["chains"].items()]} if mapping else {},
+        "lhs": lhs, "rhs_offsets": rhs_offsets, "rhs": rhs,
+        "lexical": lexical, "binary": binary,
+        "lookahead_offsets": lookahead_offsets, "lookahead": lookahead,
+    }
+
+
+# ------------------------------------------------------------------
+# on-disk format:
+# magic (4 bytes), header length (4 bytes), JSON header, padding to a multiple of 4,
+# then the int32 arrays; the header holds the symbol table and the offset and length of each array
+
+def save_compiled(compiled, path):
+    header = {key: compiled[key] for key in compiled if key not in array_names}
+    header["version"] = version
+    offset = 0
+    header["arrays"] = {}
+    for name in array_names:
+        header["arrays"][name] = [offset, len(compiled[name])]
+        offset += 4 * len(compiled[name])
+    data = json.dumps(header).encode("utf-8")
+    data += b" " * (-(len(magic) + 4 + len(data)) % 4)
+    # write to a temporary file first, so concurrent workers never see a half-written cache file
+    tmp = path + "." + str(os.getpid()) + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(magic + struct.pack("<I", len(data)) + data)
+        for name in array_names:
+            f.write(array.array("i", compiled[name]).tobytes())
+    os.replace(tmp, path)
+
+
+def open_compiled(path):
+    # memory-maps a compiled grammar; the arrays are zero-copy int views of the file
+    # (ValueError or struct.error if the file is not a complete compiled grammar of this version)
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if mm[:4] != magic:
+        raise ValueError(path + " is not a compiled grammar")
+    (length,) = struct.unpack("<I", mm[4:8])
+    compiled = json.loads(mm[8:8+length].decode("utf-8"))
+    if compiled.get("version") != version:
+        raise ValueError(path + " was written by another version of grammar_cache")
+    base = 8 + length
+    if base + 4 * sum(n for (offset, n) in compiled["arrays"].values()) != len(mm):
+        raise ValueError(path + " is truncated")
+    view = memoryview(mm)
+    for name in array_names:
+        (offset, n) = compiled["arrays"][name]
+        compiled[name] = view[base+offset:base+offset+4*n].cast("i")
+    return compiled
+
+
+def load_compiled(grammar, start="S", directory=None):
+    # returns the compiled grammar, from the cache if possible (otherwise it is compiled and cached)
+    if directory is None:
+        directory = cache_dir
+    key = hashlib.sha256("\0".join([str(version), start, grammar]).encode("utf-8")).hexdigest()
+    path = os.path.join(directory, key + ".pgc")
+    if os.path.exists(path):
+        # (a file of another version, or a truncated or corrupt one, is compiled again and replaced)
+        try:
+            return open_compiled(path)
+        except (ValueError, struct.error):
+            pass
+    compiled = compile_grammar(grammar, start)
+    os.makedirs(directory, exist_ok=True)
+    save_compiled(compiled, path)
+    return compiled
+
+
+# ------------------------------------------------------------------
+# view in the format of the CYK parsers:
+
+def cyk_grammar(compiled):
+    # format of load_grammar in cyk_skeleton.py: (G1, G2, mapping)
+    symbols = compiled["symbols"]
+    lexical = compiled["lexical"]
+    binary = compiled["binary"]
+    G1 = {}
+    for i in range(0, len(lexical), 2):
+        G1.setdefault(symbols[lexical[i]], [])
+        G1[symbols[lexical[i]]].append(symbols[lexical[i+1]])
+    G2 = {}
+    for i in range(0, len(binary), 3):
+        key = (symbols[binary[i]], symbols[binary[i+1]])
+        G2.setdefault(key, [])
+        G2[key].append(symbols[binary[i+2]])
+    mapping = {}
+    if compiled["mapping"]:
+        mapping["symbols"] = compiled["mapping"]["symbols"]
+        mapping["chains"] = {(A, tuple(RHS)): chain for (A, RHS, chain) in compiled["mapping"]["chains"]}
+    return G1, G2, mapping
+
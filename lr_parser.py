@@ -0,0 +1,346 @@
+# lr_parser.py
+# course "Parsing"
+
+# Table-driven shift-reduce parsing: the grammar is compiled into an LR automaton with
+# action/goto tables (LR(0), SLR or LALR(1) lookaheads), and the driver only forks on real
+# conflicts. For deterministic grammars this runs in linear time instead of trying every
+# shift/reduce interleaving like parse_with_agenda in 7_2.py / 7_3.py.
+
+from nltk import CFG, Tree
+
+import tracing
+from parse_utils import first_follow_sets, first_of_sequence
+
+trace = tracing.print_events  # None   (subscriber for the parsing events, see tracing.py)
+interactive = False
+
+start_symbol = "S"
+end_marker = "$"
+
+# string format used in nltk class:
+# our test grammar:
+
+grammar_left_recursion = """
+S -> NP VP
+NP -> NP N |DET N | DET N PP | 'I'
+VP -> V | V NP | V NP PP
+PP -> P NP
+DET -> 'the' | 'an' | 'my' | 'most'
+P -> 'in'
+N -> 'elephant' | 'elephants' | 'mouse' | 'mice' | 'pajamas' | 'fish' | 'factory' | 'worker'
+V -> 'sneezed' | 'giggled' | 'trumpeted' | 'saw' | 'shot'
+"""
+
+grammar_arithmetic = """
+S -> S '+' T | T
+T -> T '*' F | F
+F -> '(' S ')' | 'x' | 'y'
+"""
+
+sentences = [
+"I shot the elephant in my pajamas",
+"I shot elephant in my pajamas",
+"the elephant saw a mouse",
+"saw the elephant a mouse",
+"I saw the fish factory worker"
+]
+
+
+# ------------------------------------------------------------------
+# table compilation:
+
+def build_lr_tables(grammar, method="lalr"):
+    # grammar: CFG in nltk string format
+    # method:  "lr0", "slr" or "lalr" (how the lookaheads of the reduce actions are computed)
+
+    # returns a dict with
+    # - "productions":  list of (LHS, RHS tuple); production 0 is the augmented rule S' -> S
+    # - "nonterminals": set of non-terminals
+    # - "states":       list of LR(0) item sets (kernels); an item is a pair (production, dot position)
+    # - "action":       dict (state, terminal) -> list of actions ("shift", state) / ("reduce", production) / ("accept",)
+    # - "goto":         dict (state, non-terminal) -> state
+    # - "conflicts":    list of (state, terminal, actions) for all table cells with more than one action
+
+    cfg = CFG.fromstring(grammar)
+    productions = [(start_symbol + "'", (start_symbol,))]
+    for P in cfg.productions():
+        # (a rule listed twice would make every reduction with it ambiguous)
+        if (str(P.lhs()), tuple(str(A) for A in P.rhs())) not in productions:
+            productions.append((str(P.lhs()), tuple(str(A) for A in P.rhs())))
+    nonterminals = set(LHS for (LHS, RHS) in productions)
+    by_LHS = {}
+    for p in range(len(productions)):
+        by_LHS.setdefault(productions[p][0], [])
+        by_LHS[productions[p][0]].append(p)
+
+    def closure(kernel):
+        items = list(kernel)
+        seen = set(items)
+        for (p, dot) in items:
+            RHS = productions[p][1]
+            if dot < len(RHS) and RHS[dot] in nonterminals:
+                for q in by_LHS[RHS[dot]]:
+                    if (q, 0) not in seen:
+                        seen.add((q, 0))
+                        items.append((q, 0))
+        return items
+
+    def successors(kernel):
+        # kernels of the states reached from kernel by each symbol
+        succ = {}
+        for (p, dot) in closure(kernel):
+            RHS = productions[p][1]
+            if dot < len(RHS):
+                succ.setdefault(RHS[dot], [])
+                succ[RHS[dot]].append((p, dot+1))
+        return succ
+
+    # canonical collection of LR(0) item sets (identified by their kernels):
+    states = [frozenset([(0, 0)])]
+    number = {states[0]: 0}
+    transitions = {}
+    i = 0
+    while i < len(states):
+        for (X, kernel) in successors(states[i]).items():
+            kernel = frozenset(kernel)
+            if kernel not in number:
+                number[kernel] = len(states)
+                states.append(kernel)
+            transitions[(i, X)] = number[kernel]
+        i += 1
+
+    nullable, first, follow = first_follow_sets(productions, productions[0][0], end_marker)
+
+    # reduce lookaheads: reductions[state] is a list of (production, set of terminals)
+    terminals = set(X for (LHS, RHS) in productions for X in RHS if X not in nonterminals) | {end_marker}
+    reductions = []
+    if method == "lalr":
+        lookaheads = lalr_lookaheads(productions, nonterminals, by_LHS, states, transitions, nullable, first)
+    for i in range(len(states)):
+        reductions.append([])
+        if method == "lalr":
+            for ((p, dot), las) in lr1_closure(productions, nonterminals, by_LHS, nullable, first,
+                                                [(item, lookaheads[(i, item)]) for item in states[i]]).items():
+                if dot == len(productions[p][1]):
+                    reductions[i].append((p, las))
+        else:
+            for (p, dot) in closure(states[i]):
+                if dot == len(productions[p][1]):
+                    if method == "slr":
+                        reductions[i].append((p, follow[productions[p][0]]))
+                    else:
+                        reductions[i].append((p, terminals))
+
+    # action and goto tables:
+    action = {}
+    goto = {}
+    for ((i, X), j) in transitions.items():
+        if X in nonterminals:
+            goto[(i, X)] = j
+        else:
+            action.setdefault((i, X), [])
+            action[(i, X)].append(("shift", j))
+    for i in range(len(states)):
+        for (p, las) in reductions[i]:
+            for a in las:
+                if p == 0:
+                    # S' -> S . (only at the end of the input)
+                    if a == end_marker:
+                        action.setdefault((i, a), [])
+                        action[(i, a)].append(("accept",))
+                else:
+                    action.setdefault((i, a), [])
+                    action[(i, a)].append(("reduce", p))
+
+    conflicts = [(i, a, action[(i, a)]) for (i, a) in action if len(action[(i, a)]) > 1]
+    return {"productions": productions, "nonterminals": nonterminals, "states": states,
+            "action": action, "goto": goto, "conflicts": conflicts}
+
+
+def lr1_closure(productions, nonterminals, by_LHS, nullable, first, items):
+    # LR(1) closure of a list of (LR(0) item, set of lookaheads);
+    # returns a dict LR(0) item -> set of lookaheads
+    result = {}
+    agenda = []
+    for (item, las) in items:
+        result.setdefault(item, set())
+        result[item] |= las
+        agenda.append(item)
+    while agenda:
+        (p, dot) = agenda.pop()
+        RHS = productions[p][1]
+        if dot < len(RHS) and RHS[dot] in nonterminals:
+            rest = RHS[dot+1:]
+            las = first_of_sequence(rest, nonterminals, nullable, first)
+            if all(X in nullable for X in rest):
+                las = las | result[(p, dot)]
+            for q in by_LHS[RHS[dot]]:
+                if (q, 0) not in result:
+                    result[(q, 0)] = set()
+                if not las <= result[(q, 0)]:
+                    result[(q, 0)] |= las
+                    agenda.append((q, 0))
+    return result
+
+
+def lalr_lookaheads(productions, nonterminals, by_LHS, states, transitions, nullable, first):
+    # LALR(1) lookaheads of all kernel items, by spontaneous generation and propagation
+    # (determined with the dummy lookahead '#', cf. the "dragon book", algorithm 4.62/4.63)
+    # returns a dict (state, kernel item) -> set of lookaheads
+    lookaheads = {}
+    propagate = {}
+    for i in range(len(states)):
+        for item in states[i]:
+            lookaheads[(i, item)] = set()
+    lookaheads[(0, (0, 0))].add(end_marker)
+    for i in range(len(states)):
+        for item in states[i]:
+            for ((p, dot), las) in lr1_closure(productions, nonterminals, by_LHS, nullable, first, [(item, {"#"})]).items():
+                RHS = productions[p][1]
+                if dot < len(RHS):
+                    target = (transitions[(i, RHS[dot])], (p, dot+1))
+                    for a in las:
+                        if a == "#":
+                            propagate.setdefault((i, item), [])
+                            propagate[(i, item)].append(target)
+                        else:
+                            lookaheads[target].add(a)
+    changed = True
+    while changed:
+        changed = False
+        for source in propagate:
+            for target in propagate[source]:
+                if not lookaheads[source] <= lookaheads[target]:
+                    lookaheads[target] |= lookaheads[source]
+                    changed = True
+    return lookaheads
+
+
+# ------------------------------------------------------------------
+# driver:
+
+# recursive procedure for converting sequence of arity/symbol pairs into a tree
+# (same format as in 7_2.py / 7_3.py: the derivation lists shifts and reductions in order)
+def build_tree(deriv):
+    if len(deriv) > 0:
+        (arity, NT) = deriv[-1]
+
+        Subtrees = []
+        deriv_rest = deriv[:-1]
+        for i in range(arity):
+            (Subtree_i, deriv_rest) = build_tree(deriv_rest)
+            Subtrees = [Subtree_i] + Subtrees
+        return Tree(NT, Subtrees), deriv_rest
+    else:
+        return_deriv = list(deriv)
+        return [], return_deriv
+
+
+def parse_with_lr(tables, tokens):
+    # tables: result of build_lr_tables
+    # tokens: list of input tokens
+
+    # returns the same pair as parse_with_agenda in 7_3.py, so it can be passed to parse_batch_with_agenda:
+    # - the number of processing steps and
+    # - the number of solutions
+
+    # collect all solutions (the parsing itself is done by iter_parses)
+    search = iter_parses(tables, tokens)
+    parses = []
+    while True:
+        try:
+            parses.append(next(search))
+        except StopIteration as finished:
+            # (the generator returns its step counter)
+            counter = finished.value
+            break
+
+    if interactive:
+        sol = 0
+        for deriv in parses:
+            sol += 1
+            tree, subtrees = build_tree(deriv)
+            print("solution ", sol)
+            print(deriv)
+            tree.draw()
+    return counter, len(parses)
+
+
+def iter_parses(tables, tokens):
+    # generator version of parse_with_lr: yields each derivation (list of arity/symbol pairs, see build_tree)
+    # at the accept action; for a conflict-free table there is only one, and otherwise the other
+    # actions of the conflicting cells are only tried when the next one is asked for
+    # returns the step counter (as the value of StopIteration)
+
+    # The agenda only holds more than one item when a table cell has several actions (a real conflict);
+    # each item is a triple (stack, position, deriv), where stack is a persistent stack of states
+    # and deriv a persistent stack of (arity, symbol) pairs (pairs (top, rest), None when empty).
+
+    if trace: trace("parse", tokens=tokens, method="LR")
+    productions = tables["productions"]
+    action = tables["action"]
+    goto = tables["goto"]
+
+    agenda = [((0, None), 0, None)]
+    sol = 0
+    counter = 0
+    while len(agenda) > 0:
+        (stack, pos, deriv) = agenda.pop()
+        counter += 1
+        a = tokens[pos] if pos < len(tokens) else end_marker
+        actions = action.get((stack[0], a), [])
+        if actions == []:
+            if trace: trace("backtrack", reason="no action for " + str(a) + " in state " + str(stack[0]))
+        if len(actions) > 1:
+            if trace: trace("conflict", state=stack[0], token=a, actions=actions)
+
+        for act in actions:
+            if act[0] == "shift":
+                if trace: trace("shift", symbol=a)
+                agenda.append(((act[1], stack), pos+1, ((0, a), deriv)))
+            elif act[0] == "reduce":
+                (LHS, RHS) = productions[act[1]]
+                if trace: trace("reduce", rhs=RHS, lhs=LHS)
+                rest = stack
+                for X in RHS:
+                    rest = rest[1]
+                agenda.append(((goto[(rest[0], LHS)], rest), pos, ((len(RHS), LHS), deriv)))
+            else:
+                if trace: trace("accept")
+                D = []
+                rest = deriv
+                while rest is not None:
+                    D.append(rest[0])
+                    rest = rest[1]
+                D.reverse()
+                sol += 1
+                yield D
+
+    if trace: trace("solutions", count=sol)
+    return counter
+
+
+def demo():
+    for (name, grammar) in [("grammar_arithmetic", grammar_arithmetic), ("grammar_left_recursion", grammar_left_recursion)]:
+        for method in ["lr0", "slr", "lalr"]:
+            tables = build_lr_tables(grammar, method)
+            print(name, method + ":", len(tables["states"]), "states,", len(tables["conflicts"]), "conflicts")
+    tables = build_lr_tables(grammar_arithmetic)
+    print(parse_with_lr(tables, "( x + y ) * x + y".split()))
+    tables = build_lr_tables(grammar_left_recursion)
+    if interactive:
+        while True:
+            sentence = input('Type sentence ("q" to quit): ')
+            if sentence == 'q':
+                break
+            else:
+                tokens = sentence.split()
+                parse_with_lr(tables, tokens)
+    else:
+        for sentence in sentences:
+            tokens = sentence.split()
+            print(sentence, parse_with_lr(tables, tokens))
+
+
+if __name__ == "__main__":
+    demo()
@@ -0,0 +1,74 @@
+# parse_stats.py
+# course "Parsing"
+
+# Statistics of a single parse, for the agenda parsers (question3.py, 5_2.py, 7_2.py, 7_3.py).
+# A ParseStats object is passed to the parser as an optional out-parameter and filled in
+# instead of printing anything:
+#     stats = ParseStats(memory=True)
+#     question3.parse_with_agenda(G, tokens, stats=stats)
+#     print(stats.max_agenda, stats.dead_ends, stats.phases, stats.peak_kb)
+# The parsers count in local variables and only copy the counts into the object at the end,
+# so passing no stats object costs nothing.
+
+import time
+import tracemalloc
+
+
+class ParseStats:
+
+    def __init__(self, memory=False):
+        # memory: measure the peak memory of the parse with tracemalloc (this slows down parsing)
+        self.memory = memory
+        self.steps = 0            # the parser's counter (agenda items processed)
+        self.max_agenda = None    # maximum length of the agenda (None for parsers without agenda)
+        self.expands = 0
+        self.matches = 0
+        self.shifts = 0
+        self.reduces = 0
+        self.dead_ends = 0        # agenda items without successors (backtracking points)
+        self.dedupe_hits = 0      # work saved by memoization or deduplication
+        self.solutions = 0
+        self.phases = {}          # phase name -> seconds, e.g. "setup", "search", "readout"
+        self.peak_kb = None       # peak memory in KB (with memory=True)
+        self.last = None
+        self.baseline = 0
+        self.own_tracing = False
+
+    def start(self):
+        # called by the parser when it starts; starts the clock (and tracemalloc)
+        if self.memory:
+            if tracemalloc.is_tracing():
+                self.baseline = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+            else:
+                self.baseline = 0
+                self.own_tracing = True
+                tracemalloc.start()
+        self.last = time.perf_counter()
+
+    def lap(self, phase):
+        # adds the time since start or the previous lap to the given phase
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self.last
+        self.last = now
+
+    def stop(self):
+        # called by the parser when it is done
+        if self.memory:
+            peak = tracemalloc.get_traced_memory()[1] - self.baseline
+            self.peak_kb = max(peak, 0) / 1024
+            if self.own_tracing:
+                self.own_tracing = False
+                tracemalloc.stop()
+
+    def seconds(self):
+        return sum(self.phases.values())
+
+    def as_dict(self):
+        return {"steps": self.steps, "max_agenda": self.max_agenda, "expands": self.expands,
+                "matches": self.matches, "shifts": self.shifts, "reduces": self.reduces,
+                "dead_ends": self.dead_ends, "dedupe_hits": self.dedupe_hits, "solutions": self.solutions,
+                "phases": dict(self.phases), "seconds": self.seconds(), "peak_kb": self.peak_kb}
+
+    def __repr__(self):
+        return "ParseStats(" + ", ".join(key + "=" + repr(value) for (key, value) in self.as_dict().items()) + ")"
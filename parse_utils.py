@@ -0,0 +1,124 @@
+# parse_utils.py
+# course "Parsing"
+
+# Helpers shared by the parsers:
+# - nullable non-terminals, FIRST and FOLLOW sets (LL(1) tables in 5_1.py, lookahead tables of the
+#   top-down parsers question3.py / 5_2.py, LR tables in lr_parser.py)
+# - persistent (structure-sharing) stacks for the agenda items of the top-down parsers
+# - first_parse and has_parse, which stop a parse generator (the iter_parses of any parser) early
+# The grammar analysis works on a list of (LHS, RHS sequence) pairs, so it does not depend on the
+# grammar format of a parser; topdown_productions converts the format of question3.py / 5_1.py / 5_2.py.
+
+
+# ------------------------------------------------------------------
+# FIRST and FOLLOW sets (computed once per grammar):
+
+def first_follow_sets(productions, start='S', end_marker='$'):
+    # productions: list of (LHS, RHS sequence) pairs
+    # start:       start symbol (its FOLLOW set contains end_marker, the end of the input)
+    # returns the set of nullable non-terminals and dicts with the FIRST and FOLLOW set of each non-terminal
+    nonterminals = set(LHS for (LHS, RHS) in productions)
+    nullable = set()
+    first = {NT: set() for NT in nonterminals}
+    follow = {NT: set() for NT in nonterminals}
+    follow[start] = {end_marker}
+
+    changed = True
+    while changed:
+        changed = False
+        for (NT, RHS) in productions:
+            # FIRST(NT) includes FIRST of the RHS
+            F = first_of_sequence(RHS, nonterminals, nullable, first)
+            if not F <= first[NT]:
+                first[NT] |= F
+                changed = True
+            if NT not in nullable and all(X in nullable for X in RHS):
+                nullable.add(NT)
+                changed = True
+            # FOLLOW(X) includes FIRST of what comes after X (and FOLLOW(NT), if that is nullable)
+            for i in range(len(RHS)):
+                if RHS[i] in nonterminals:
+                    F = first_of_sequence(RHS[i+1:], nonterminals, nullable, first)
+                    if all(Y in nullable for Y in RHS[i+1:]):
+                        F = F | follow[NT]
+                    if not F <= follow[RHS[i]]:
+                        follow[RHS[i]] |= F
+                        changed = True
+    return nullable, first, follow
+
+
+def first_of_sequence(symbols, nonterminals, nullable, first):
+    # FIRST set of a sequence of symbols (terminals are their own FIRST set)
+    F = set()
+    for X in symbols:
+        if X not in nonterminals:
+            F.add(X)
+            break
+        F |= first[X]
+        if X not in nullable:
+            break
+    return F
+
+
+def topdown_productions(G):
+    # G: dict with list of reversed rhs's for each non-terminal
+    # returns the list of (LHS, RHS list) pairs
+    return [(NT, list(reversed(Prod))) for NT in G for Prod in G[NT]]
+
+
+def lookahead_table(G, start='S'):
+    # G: dict with list of reversed rhs's for each non-terminal
+    # table[NT][token]: the productions of G[NT] (in the same order) that can start with token,
+    # i.e. token is in FIRST of the production, or the production is nullable and token is in FOLLOW(NT)
+    # (expanding any other production of NT with token as the next input symbol is a dead end)
+    nullable, first, follow = first_follow_sets(topdown_productions(G), start)
+    table = {}
+    for NT in G:
+        table[NT] = {}
+        for Prod in G[NT]:
+            RHS = list(reversed(Prod))
+            tokens = first_of_sequence(RHS, G, nullable, first)
+            if all(X in nullable for X in RHS):
+                tokens = tokens | follow[NT]
+            for token in tokens:
+                table[NT].setdefault(token, [])
+                table[NT][token] += [Prod]
+    return table
+
+
+# ------------------------------------------------------------------
+# persistent (structure-sharing) stacks: a stack is either None (empty) or a pair (top, rest)
+# pushing creates new pairs on top of rest, which is shared (not copied) by all stacks built on it
+
+def push_all(stack, symbols):
+    # pushes the symbols in list order (the last one ends up on top, as with stack + symbols)
+    for X in symbols:
+        stack = (X, stack)
+    return stack
+
+
+def stack_to_list(stack):
+    # converts a persistent stack into a list (bottom first)
+    L = []
+    while stack is not None:
+        L.append(stack[0])
+        stack = stack[1]
+    L.reverse()
+    return L
+
+
+# ------------------------------------------------------------------
+# parse generators: every parser has a generator iter_parses that yields the parses as they are found
+
+def first_parse(search):
+    # search: parse generator, e.g. question3.iter_parses(G, tokens) or earley.iter_parses(G, tokens)
+    # returns the first parse (None if there is none); the generator is closed right after it,
+    # so the rest of the search is skipped (and the stats of the agenda parsers are filled in)
+    parse = next(search, None)
+    search.close()
+    return parse
+
+
+def has_parse(search):
+    # grammaticality check: stops at the first parse
+    return first_parse(search) is not None
@@ -89,5 +89,5 @@ def main(grammar):
         else:
             exit()
 
-main(grammar)
-
+if __name__ == "__main__":
+    main(grammar)
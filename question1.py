@@ -80,6 +80,6 @@ def demo():
         parse(G, tokens)
 
 
-demo()
-
 
+if __name__ == "__main__":
+    demo()
@@ -100,5 +100,6 @@ def demo():
         parse(G, tokens)
 
 
-demo()
 
+if __name__ == "__main__":
+    demo()
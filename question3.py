@@ -2,13 +2,17 @@
 # Jonas Kuhn, University of Stuttgart, 2020
 # course "Parsing"
 
+import heapq
+
 from nltk import CFG, Tree
-import matplotlib.pyplot as plt
 
+from agenda import prior_score, score_derivation, score_input, score_stack
+import tracing
+from parse_utils import lookahead_table, push_all, stack_to_list
 
-trace = True  # False
+trace = tracing.print_events  # None   (subscriber for the parsing events, see tracing.py)
 interactive = False
-show_action = True  # False
+memoize = False  # True   (parse_with_agenda uses the memo table of parse_with_memo)
 
 # string format used in nltk class:
 # our test grammar:
@@ -120,86 +124,393 @@ def build_tree(deriv):
 
 # ------------------------------------------------------------------
 # main procedure:
-def parse_with_agenda(G, tokens):
-    # G:      dict with list of reversed rhs's for each non-terminal
-    # tokens: list of input tokens
+def parse_with_agenda(G, tokens, lookahead=None, start='S', stats=None, agenda=None):
+    # G:         dict with list of reversed rhs's for each non-terminal
+    # tokens:    list of input tokens
+    # lookahead: optional result of lookahead_table(G); if given, only the productions that
+    #            can start with the next input token are put on the agenda
+    # start:     start symbol (the symbols can be of any type, e.g. the ints of grammar.Grammar.topdown_view)
+    # stats:     optional parse_stats.ParseStats, filled in with the statistics of this parse
+    # agenda:    optional empty agenda object, e.g. an agenda.BestFirstAgenda with one of the scoring
+    #            functions of agenda.py (default: a list, i.e. depth-first search)
+
+    if memoize:
+        return parse_with_memo(G, tokens, lookahead, start, stats)
+
+    # collect all solutions (the search itself is done by iter_parses)
+    search = iter_parses(G, tokens, lookahead, start, stats, agenda)
+    parses = []
+    while True:
+        try:
+            parses += [next(search)]
+        except StopIteration as finished:
+            # (the generator returns its step counter)
+            counter = finished.value
+            break
 
-    if trace: print("parsing ", tokens, "...")
+    sol = 0
+    for deriv in parses:
+        sol += 1
+    return counter, sol
 
+
+def iter_parses(G, tokens, lookahead=None, start='S', stats=None, agenda=None):
+    # generator version of parse_with_agenda (same arguments): yields each derivation (list of
+    # arity/symbol pairs, see build_tree) when an item has matched all of the input with an empty stack;
+    # the items left on the agenda are only expanded when the next derivation is asked for, so
+    # parse_utils.first_parse explores no more of the search space than it needs
+    # (with memoize, the memo table is built completely before the first derivation)
+    # returns the step counter (as the value of StopIteration)
+    # stats are filled in when the search is exhausted or the generator is closed
+    # (the time the caller spends between two derivations counts as search time)
+
+    if memoize:
+        return (yield from iter_memo_parses(G, tokens, lookahead, start, stats))
+
+    if trace: trace("parse", tokens=tokens)
+    if stats is not None: stats.start()
+
+    # agenda items are tuples (stack, position, deriv, depth, length, cost):
+    # - stack and deriv are persistent stacks (see parse_utils.push_all), so pushing an item shares
+    #   everything below the top with its siblings instead of copying it
+    # - position is the index of the next input token (instead of a copy of the rest of the input)
+    # - depth and length are the numbers of symbols on stack and of steps in deriv, and cost is the sum of
+    #   the costs of the steps (with the step costs of a best-first agenda, see agenda.py; else 0.0); they
+    #   are updated from the item's predecessor, so the scoring functions never walk the persistent stacks
     # initialize agenda:
-    agenda = [(['S'], tokens, [])]
-    # initalize list for collecting complete solutions:
-    parses = []
-    # initialize counter
+    if agenda is None:
+        agenda = []
+    costs = getattr(agenda, "costs", None)
+    agenda.append(((start, None), 0, None, 1, 0, 0.0))
+    # initialize counters (counter: agenda items processed, sol: solutions found)
     counter = 0
-    # main loop:
-    while len(agenda) > 0:
-        (stack, inbuffer, in_deriv) = agenda.pop()
-        counter += 1
-        deriv = list(in_deriv)  # create copy
-
-        if trace: print('           {:<40}{:>40}'.format(str(stack), str(inbuffer)))
-
-        if len(inbuffer) > 0 and len(stack) > 0:
-
-            # expand
-            if stack[-1] in G:
-                ## backtracking algorithm: put all possible right-hand sides on agenda (replacing the non-terminal on top):
-                NT = stack.pop()
-                for Prod in G[NT]:
-                    if show_action: print(" >expand: ", NT, " -R-> ", Prod)
-                    deriv1 = deriv + [(len(Prod), NT)]
-                    stack1 = stack + Prod
-                    agenda += [(stack1, inbuffer, deriv1)]
-                    # here, we put the last production as the last element (i.e., it will be taken off first)
-
-            # match
-            elif stack[-1] == inbuffer[0]:
-                if show_action: print(" >match:  ", stack[-1])
-                deriv += [(0, stack[-1])]
-                agenda += [(stack[:-1], inbuffer[1:], deriv)]
-
-            # no match:
-            else:
-                if show_action: print(" >backtracking (no match for terminal)")
-                # we need to do nothing; next agenda item will be considered
+    sol = 0
+    expands = 0
+    matches = 0
+    dead_ends = 0
+    max_agenda = 1
+    try:
+        # main loop:
+        while len(agenda) > 0:
+            if len(agenda) > max_agenda:
+                max_agenda = len(agenda)
+            (stack, pos, deriv, depth, length, cost) = agenda.pop()
+            counter += 1
+
+            if trace: trace("item", stack=stack_to_list(stack), rest=tokens[pos:])
+
+            if pos < len(tokens) and stack is not None:
+                (top, rest) = stack
+
+                # expand
+                if top in G:
+                    ## backtracking algorithm: put all possible right-hand sides on agenda (replacing the non-terminal on top):
+                    if lookahead is None:
+                        productions = G[top]
+                    else:
+                        productions = lookahead[top].get(tokens[pos], [])
+                    if len(productions) == 0:
+                        dead_ends += 1
+                    for Prod in productions:
+                        if trace: trace("expand", symbol=top, rhs=Prod)
+                        expands += 1
+                        step = (len(Prod), top)
+                        if costs is not None:
+                            cost1 = cost + costs.get(step, 0.0)
+                        else:
+                            cost1 = cost
+                        agenda += [(push_all(rest, Prod), pos, (step, deriv), depth-1+len(Prod), length+1, cost1)]
+                        # here, we put the last production as the last element (i.e., it will be taken off first)
+
+                # match
+                elif top == tokens[pos]:
+                    if trace: trace("match", symbol=top)
+                    matches += 1
+                    step = (0, top)
+                    if costs is not None:
+                        cost1 = cost + costs.get(step, 0.0)
+                    else:
+                        cost1 = cost
+                    agenda += [(rest, pos+1, (step, deriv), depth-1, length+1, cost1)]
+
+                # no match:
+                else:
+                    if trace: trace("backtrack", reason="no match for terminal")
+                    dead_ends += 1
+                    # we need to do nothing; next agenda item will be considered
+
+            # check termination condition (inbuffer == []:)
+            elif stack is None and pos == len(tokens):
+                if trace: trace("success")
+                sol += 1
+                yield stack_to_list(deriv)
 
-        # check termination condition (inbuffer == []:)
-        elif stack == [] and inbuffer == []:
-            print(" >success!")
-            parses += [deriv]
+            else:
+                if trace: trace("backtrack", reason="stack or buffer was empty")
+                dead_ends += 1
+                # again: we need to do nothing; next agenda item will be considered
+
+        if trace: trace("solutions", count=sol)
+    finally:
+        if stats is not None:
+            stats.lap("search")
+            stats.steps = counter
+            stats.max_agenda = max_agenda
+            stats.expands = expands
+            stats.matches = matches
+            stats.dead_ends = dead_ends
+            stats.solutions = sol
+            stats.stop()
+    return counter
+
+
+# memoized version of the top-down search:
+# every non-terminal is expanded at most once per input position; the memo table records
+# which end positions it can reach from there and how (the derivation fragments), so the
+# search is polynomial instead of exponential and finds the same derivations
+def parse_with_memo(G, tokens, lookahead=None, start='S', stats=None):
+    # G:         dict with list of reversed rhs's for each non-terminal
+    # tokens:    list of input tokens
+    # lookahead: optional result of lookahead_table(G), as for parse_with_agenda
+    # start:     start symbol
+    # stats:     optional parse_stats.ParseStats (dedupe_hits: expansions answered from the memo table)
+
+    # returns the same pair as parse_with_agenda
+
+    if trace: trace("parse", tokens=tokens, method="memoized")
+    if stats is not None: stats.start()
+
+    memo, counter = build_memo(G, tokens, lookahead, start, stats)
+    if stats is not None: stats.lap("search")
+    sol = count_memo_derivations(G, memo, start, 0, len(tokens), {})
+    if trace:
+        if sol > 0: trace("success")
+        trace("solutions", count=sol)
+    if stats is not None:
+        stats.lap("readout")
+        stats.solutions = sol
+        stats.stop()
+    return counter, sol
 
-        else:
-            if show_action: print(" >backtracking (stack or buffer was empty)")
-            # again: we need to do nothing; next agenda item will be considered
 
-    if trace: print(len(parses), ' solutions')
+def iter_memo_parses(G, tokens, lookahead=None, start='S', stats=None):
+    # generator version of parse_with_memo, as iter_parses for parse_with_agenda: the memo table is
+    # built completely first, but the derivations are only read out of it as they are asked for
+    if trace: trace("parse", tokens=tokens, method="memoized")
+    if stats is not None: stats.start()
 
+    memo, counter = build_memo(G, tokens, lookahead, start, stats)
+    if stats is not None: stats.lap("search")
     sol = 0
-    for deriv in parses:
-        sol += 1
-    return counter, sol
+    try:
+        for deriv in memo_derivations(G, memo, tokens, start, 0, len(tokens)):
+            if trace: trace("success")
+            sol += 1
+            yield deriv
+        if trace: trace("solutions", count=sol)
+    finally:
+        if stats is not None:
+            stats.lap("readout")
+            stats.solutions = sol
+            stats.stop()
+    return counter
+
+
+def build_memo(G, tokens, lookahead=None, start='S', stats=None):
+    # fills the memo table for expanding start at position 0 and returns it together with the step counter
+    # stats: optional parse_stats.ParseStats for the counts (steps, expands, matches, dead ends, memo hits)
+    # (the derivations can be read out with memo_derivations(G, memo, tokens, 'S', 0, len(tokens)))
+
+    # memo[(NT, i)]: dict mapping each reachable end position to a list of fragments (r, ends), where r is
+    #                the index of the production in G[NT] and ends are the end positions of its daughters
+    #                (in left-to-right order)
+    # As in the agenda search, which stops at the end of the input, a non-terminal is not expanded there
+    # (even if it derives the empty string), so both find the same derivations.
+    # Left recursion (NT expanded again at i while (NT, i) is still under construction) is handled by
+    # growing the entries to a fixpoint: the recursive call gets the entry of the previous round
+    # (empty in the first one), and the rounds are repeated until no entry changes, so every round
+    # adds the derivations with one more level of left recursion (the agenda search never terminates
+    # on left recursion). Without left recursion, there is only one round.
+    memo = {}
+    counter = 0
+    expands = 0
+    matches = 0
+    dead_ends = 0
+    hits = 0
+    done = set()        # entries computed in this round
+    active = set()      # entries under construction
+    cyclic = False      # an entry under construction was used in this round
+    changed = False     # an entry has grown in this round
+
+    def expand(NT, i):
+        nonlocal counter, expands, matches, dead_ends, hits, cyclic, changed
+        if (NT, i) in done or (NT, i) in active:
+            if (NT, i) in active:
+                cyclic = True
+            if trace: trace("memo", symbol=NT, pos=i, ends=list(memo.get((NT, i), {})))
+            hits += 1
+            return memo.get((NT, i), {})
+        active.add((NT, i))
+        reached = {}
+        if i == len(tokens):
+            if trace: trace("backtrack", reason="stack or buffer was empty")
+            dead_ends += 1
+            productions = []
+        elif lookahead is None:
+            productions = list(enumerate(G[NT]))
+        else:
+            # (the lookahead entry keeps the order of G[NT], and equal productions are both in it or both not)
+            allowed = lookahead[NT].get(tokens[i], [])
+            productions = [(r, Prod) for (r, Prod) in enumerate(G[NT]) if Prod in allowed]
+        for (r, Prod) in reversed(productions):
+            if trace: trace("expand", symbol=NT, rhs=Prod, pos=i)
+            counter += 1
+            expands += 1
+            # partial analyses of Prod: end position -> list of tuples of daughter end positions
+            partial = {i: [()]}
+            for X in reversed(Prod):
+                extended = {}
+                for pos in partial:
+                    if X in G:
+                        ends = list(expand(X, pos))
+                    else:
+                        counter += 1
+                        if pos < len(tokens) and tokens[pos] == X:
+                            if trace: trace("match", symbol=X)
+                            matches += 1
+                            ends = [pos+1]
+                        else:
+                            dead_ends += 1
+                            ends = []
+                    for end in ends:
+                        extended.setdefault(end, [])
+                        extended[end] += [ends_so_far + (end,) for ends_so_far in partial[pos]]
+                partial = extended
+            for end in partial:
+                reached.setdefault(end, [])
+                reached[end] += [(r, ends) for ends in partial[end]]
+        active.remove((NT, i))
+        done.add((NT, i))
+        if reached != memo.get((NT, i), {}):
+            changed = True
+        memo[(NT, i)] = reached
+        return reached
+
+    expand(start, 0)
+    while cyclic and changed:
+        done = set()
+        cyclic = False
+        changed = False
+        expand(start, 0)
+    if stats is not None:
+        stats.steps = counter
+        stats.expands = expands
+        stats.matches = matches
+        stats.dead_ends = dead_ends
+        stats.dedupe_hits = hits
+    return memo, counter
+
+
+def count_memo_derivations(G, memo, NT, i, j, counts):
+    # number of derivations of tokens i..j from NT in the memo table (memoized in counts)
+    if (NT, i, j) not in counts:
+        counts[(NT, i, j)] = 0      # guards against unit cycles (derivations of NT from NT over i..j)
+        total = 0
+        for (r, ends) in memo.get((NT, i), {}).get(j, []):
+            n_derivs = 1
+            start = i
+            for (X, end) in zip(reversed(G[NT][r]), ends):
+                if X in G:
+                    n_derivs *= count_memo_derivations(G, memo, X, start, end, counts)
+                start = end
+            total += n_derivs
+        counts[(NT, i, j)] = total
+    return counts[(NT, i, j)]
+
+
+def memo_derivations(G, memo, tokens, NT, i, j, path=frozenset()):
+    # generator yielding the derivations of tokens i..j from NT in the memo table,
+    # in the format of parse_with_agenda (list of arity/symbol pairs, see build_tree),
+    # in the same order as the agenda search of iter_parses (so first_parse gives the same derivation)
+    # path: the (NT, i, j) above in the derivation, which are skipped (unit cycles, as in count_memo_derivations)
+    # (the depth-first agenda tries the productions of a non-terminal from the last one in G[NT] to the
+    #  first and the non-terminals top-down from left to right, so its derivations come out sorted by the
+    #  negated indexes of their productions in that order; the alternatives of the memo table are merged
+    #  by these keys)
+    for (key, deriv) in ranked_derivations(G, memo, {}, NT, i, j, path):
+        yield deriv
+
+
+def ranked_derivations(G, memo, cache, NT, i, j, path):
+    # generator yielding pairs (key, derivation) for memo_derivations, sorted by key
+    # cache: the pairs merged so far for each span, with the generator for the rest, so a span that
+    #        occurs in many derivations is merged only once (the entries are only computed when asked for)
+    # (only the path entries over the same span matter: a smaller span cannot contain i..j again)
+    if (NT, i, j) in path:
+        return
+    path = frozenset(entry for entry in path if entry[1:] == (i, j)) | {(NT, i, j)}
+    if (NT, i, j, path) not in cache:
+        streams = [with_production(-r, len(G[NT][r]), NT,
+                                   daughter_derivations(G, memo, cache, list(reversed(G[NT][r])), i, ends, path))
+                   for (r, ends) in memo.get((NT, i), {}).get(j, [])]
+        cache[(NT, i, j, path)] = ([], heapq.merge(*streams, key=lambda pair: pair[0]))
+    (done, pending) = cache[(NT, i, j, path)]
+    k = 0
+    while True:
+        if k == len(done):
+            pair = next(pending, None)
+            if pair is None:
+                return
+            done.append(pair)
+        yield done[k]
+        k += 1
+
+
+def with_production(r, arity, NT, daughters):
+    for (key, rest) in daughters:
+        yield (r,) + key, [(arity, NT)] + rest
+
+
+def daughter_derivations(G, memo, cache, RHS, i, ends, path):
+    # (the keys of one daughter are never prefixes of each other, so concatenating them keeps the order)
+    if len(RHS) == 0:
+        yield (), []
+    else:
+        X = RHS[0]
+        if X in G:
+            firsts = ranked_derivations(G, memo, cache, X, i, ends[0], path)
+        else:
+            firsts = [((), [(0, X)])]
+        for (first_key, first) in firsts:
+            for (rest_key, rest) in daughter_derivations(G, memo, cache, RHS[1:], ends[0], ends[1:], path):
+                yield first_key + rest_key, first + rest
 
 
-def parse_batch_with_agenda(G, sentences):
+def parse_batch_with_agenda(G, sentences, parse=None):
+    # parse: procedure with the same interface as parse_with_agenda (default),
+    #        e.g. earley.parse_with_earley, for comparing the step counts of different parsers
+    if parse is None:
+        parse = parse_with_agenda
     x_values = []
     y_values = []
     for sentence in sentences:
         tokens = sentence.split()
-        y, sol = parse_with_agenda(G, tokens)
+        y, sol = parse(G, tokens)
         if sol != 0:
             x_values.append(len(tokens))
             y_values.append(y)
+    import matplotlib.pyplot as plt    # (only needed for the plot)
     plt.scatter(x_values, y_values)
     plt.show()
 
 
 G = load_grammar(grammar)
-print("Grammar:\n", G)
-print("-------------------------------------------------\n")
+table = lookahead_table(G)
 
 
 def demo():
+    print("Grammar:\n", G)
+    print("-------------------------------------------------\n")
     if interactive:
         while True:
             sentence = input('Type sentence ("q" to quit): ')
@@ -207,11 +518,10 @@ def demo():
                 break
             else:
                 tokens = sentence.split()
-                parse_with_agenda(G, tokens)
+                parse_with_agenda(G, tokens, table)
     else:
-        parse_batch_with_agenda(G, sentences)
-
-
-demo()
+        parse_batch_with_agenda(G, sentences, lambda G, tokens: parse_with_agenda(G, tokens, table))
 
 
+if __name__ == "__main__":
+    demo()
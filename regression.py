@@ -0,0 +1,243 @@
+# regression.py
+# course "Parsing"
+
+# Regression check of the parse counts: the Earley parser handles every context-free grammar,
+# so its number of parses is the reference for the other strategies on grammars that are known
+# to be hard for them (left recursion for the memoized top-down search, unit chains for the CNF
+# conversion of the CYK parsers, RHS's shared by several LHS's and a start symbol that is the
+# left corner of a larger constituent for the shift-reduce agenda). The grammars with empty
+# rules check the Earley parser itself (its nullable handling) against the memoized search,
+# and the empty sentence (a blank line in a corpus) must have no parse without crashing any engine.
+# The GLR parser does not support empty rules, so it must refuse such grammars instead of miscounting.
+# The memoized top-down search must give the derivations of the agenda search in the same order,
+# also where that differs from Earley (both stop at the end of the input, even before a nullable symbol).
+#     python regression.py
+# prints one line per case and exits with status 1 if any result differs from the expected one.
+
+import sys
+
+import batch
+import engines as parsers
+
+grammar_ss = """
+S -> S S | 'a'
+"""
+
+grammar_units = """
+S -> S S | 'a' | A
+A -> 'a' | B
+B -> 'a'
+"""
+
+grammar_cycle = """
+S -> A | 'b'
+A -> B | 'a'
+B -> A | S
+"""
+
+grammar_empty = """
+S -> NP VP
+NP -> DET ADJS N | NP PP | 'I'
+ADJS -> ADJ ADJS |
+PP -> P NP
+VP -> V NP | V
+DET -> 'the' | 'a'
+ADJ -> 'big' | 'old'
+N -> 'dog' | 'telescope'
+P -> 'with'
+V -> 'saw'
+"""
+
+# (no left recursion, so the agenda search terminates; the splits of 'b' C S interleave in the agenda order)
+grammar_order = """
+S -> 'a' | 'a' A S | C
+A -> 'a' | 'b' 'b' 'b' | C
+B -> 'b'
+C -> 'b' | 'b' C S | 'a'
+"""
+
+# (a nullable non-terminal at the end of the sentence)
+grammar_nullable_end = """
+S -> NP VP
+NP -> 'I' | 'dogs'
+VP -> V NP ADV
+V -> 'saw'
+ADV -> 'today' |
+"""
+
+# (engine, grammar, sentence): the engine's count is compared with the Earley count
+cases = [
+    ("memo", "lr.grammar_arithmetic", "y + y"),
+    ("memo", "lr.grammar_arithmetic", "( x + y ) * x + y"),
+    ("memo", "earley.grammar_left_recursion", "I saw the fish factory worker"),
+    ("memo", "earley.grammar_left_recursion", "I shot the elephant in my pajamas"),
+    ("memo", "grammar_ss", "a a"),
+    ("memo", "grammar_ss", "a a a a a"),
+    ("memo", "grammar_empty", "I saw the dog"),
+    ("memo", "grammar_empty", "the big old dog saw I"),
+    ("memo", "grammar_empty", "I saw the dog with a telescope"),
+    ("cyk", "grammar_units", "a"),
+    ("cyk", "grammar_units", "a a"),
+    ("cyk", "grammar_units", "a a a"),
+    ("cyk", "lr.grammar_arithmetic", "( x + y ) * x + y"),
+    ("cyk", "topdown.grammar", "the wild cat chased small mice in the garden with my elephant"),
+    ("memo", "grammar_ss", ""),
+    ("order", "grammar_order", "a b b b a"),
+    ("order", "grammar_nullable_end", "I saw dogs"),
+    ("order", "grammar_nullable_end", "I saw dogs today"),
+    ("order", "topdown.grammar", "the wild cat chased small mice in the garden with my elephant"),
+    ("cyk", "grammar_ss", ""),
+    ("first", "grammar_ss", ""),
+    ("first", "topdown.grammar", "the wild cat chased small mice in the garden with my elephant"),
+    ("trees", "grammar_cycle", "a"),
+    ("trees", "grammar_ss", "a a a a a"),
+    ("trees", "grammar_empty", "I saw the dog with a telescope"),
+    ("glr", "earley.grammar_left_recursion", "I shot the elephant in my pajamas"),
+    ("glr", "grammar_ss", "a a a a a"),
+    ("glr", "grammar_empty", "I saw the dog with a telescope"),
+    ("shift_reduce", "cyk.grammar", "workers can fish"),
+    ("shift_reduce", "lr.grammar_arithmetic", "x + x"),
+    ("shift_reduce", "lr.grammar_arithmetic", "( x + y ) * x + y"),
+    ("shift_reduce", "grammar_ss", "a a"),
+    ("shift_reduce", "grammar_ss", "a a a a a"),
+    ("shift_reduce", "earley.grammar_left_recursion", "I shot the elephant in my pajamas"),
+    ("shift_reduce", "topdown.grammar", "the wild cat chased small mice in the garden with my elephant"),
+]
+
+
+def grammar_text(name):
+    # "module.variable" for a grammar in an engine module (see engines), or a grammar of this module
+    if "." in name:
+        (module, variable) = name.split(".")
+        return getattr(getattr(parsers, module), variable)
+    return globals()[name]
+
+
+def earley_count(grammar, tokens):
+    E = parsers.earley
+    return E.parse_with_earley(E.load_grammar(grammar), tokens)[1]
+
+
+def memo_count(grammar, tokens):
+    T = parsers.topdown
+    G = T.load_grammar(grammar)
+    counter, sol = T.parse_with_memo(G, tokens, T.lookahead_table(G))
+    # the derivations that are read out must agree with the count
+    derivations = len(list(T.iter_memo_parses(G, tokens, T.lookahead_table(G))))
+    if derivations != sol:
+        return str(sol) + " counted, " + str(derivations) + " read out"
+    return sol
+
+
+def order_count(grammar, tokens):
+    # the memoized read-out must give the derivations of the agenda search in the same order, so that
+    # first_parse is the same with and without memoize (only for grammars without left recursion):
+    # "same" (with and without the lookahead table), or the numbers of derivations if they differ
+    T = parsers.topdown
+    G = T.load_grammar(grammar)
+    for lookahead in [None, T.lookahead_table(G)]:
+        plain = list(T.iter_parses(G, tokens, lookahead))
+        memoized = list(T.iter_memo_parses(G, tokens, lookahead))
+        if memoized != plain:
+            return str(len(plain)) + " from the agenda, " + str(len(memoized)) + " read out (or in a different order)"
+    return "same"
+
+
+def cyk_count(grammar, tokens):
+    C = parsers.cyk
+    mapping = {}
+    G1, G2 = C.load_grammar(grammar, mapping)
+    sol = C.cyk_parse_bitset(G1, G2, tokens)[0]
+    # every CNF tree must map back to a different tree of the original grammar
+    trees = set(str(tree) for tree in C.iter_parses(G1, G2, tokens, mapping))
+    if len(trees) != sol:
+        return str(sol) + " counted, " + str(len(trees)) + " distinct trees"
+    return sol
+
+
+def shift_reduce_count(grammar, tokens):
+    # the shift-reduce agenda of batch.py (on the interned grammar), with and without dedupe
+    compiled = batch.engines["shift_reduce"][0](grammar)
+    (shift_reduce, g, G, trie) = compiled
+    sol = batch.engines["shift_reduce"][1](compiled, tokens)[0]
+    deduped = shift_reduce.parse_with_agenda(G, g.encode(tokens), trie, g.start, dedupe=True)[1]
+    derivations = len(list(batch.iter_parses("shift_reduce", compiled, tokens)))
+    # (the derivations read out of the parse forest must be the same as those of the plain search)
+    plain = sorted(map(str, shift_reduce.iter_parses(G, g.encode(tokens), trie, g.start)))
+    unpacked = sorted(map(str, shift_reduce.iter_parses(G, g.encode(tokens), trie, g.start, dedupe=True)))
+    if deduped != sol or derivations != sol or unpacked != plain:
+        return str(sol) + " counted, " + str(deduped) + " deduplicated, " + str(derivations) + " read out, " \
+            + str(len(unpacked)) + " read out of the parse forest"
+    return sol
+
+
+def glr_count(grammar, tokens):
+    # the GLR parser of batch.py; "refused" if the grammar cannot be loaded (see has_empty_rules)
+    try:
+        compiled = batch.engines["glr"][0](grammar)
+    except ValueError:
+        return "refused"
+    return batch.engines["glr"][1](compiled, tokens)[0]
+
+
+def has_empty_rules(grammar):
+    E = parsers.earley
+    return any(len(RHS) == 0 for RHSs in E.earley_grammar(E.load_grammar(grammar)).values() for RHS in RHSs)
+
+
+def tree_count(grammar, tokens):
+    # the Earley trees that are read out must agree with the Earley count (also on unit cycles)
+    E = parsers.earley
+    return len(list(E.iter_parses(E.load_grammar(grammar), tokens)))
+
+
+def first_count(grammar, tokens):
+    # grammaticality check with every engine of batch.py (stopping at the first parse): 1 or 0,
+    # compared with the Earley count capped at 1 (engines that cannot load the grammar are left out)
+    found = {}
+    for engine in batch.engines:
+        try:
+            compiled = batch.engines[engine][0](grammar)
+        except ValueError:
+            continue
+        found[engine] = int(batch.has_parse(engine, compiled, tokens))
+    if len(set(found.values())) != 1:
+        return found
+    return found.popitem()[1]
+
+
+counters = {
+    "memo": memo_count,
+    "order": order_count,
+    "cyk": cyk_count,
+    "first": first_count,
+    "trees": tree_count,
+    "glr": glr_count,
+    "shift_reduce": shift_reduce_count,
+}
+
+
+def main():
+    failures = 0
+    for (engine, name, sentence) in cases:
+        grammar = grammar_text(name)
+        tokens = sentence.split()
+        expected = earley_count(grammar, tokens)
+        if engine == "first":
+            expected = min(expected, 1)
+        if engine == "glr" and has_empty_rules(grammar):
+            expected = "refused"
+        if engine == "order":
+            expected = "same"
+        found = counters[engine](grammar, tokens)
+        ok = found == expected
+        if not ok:
+            failures += 1
+        print("ok  " if ok else "FAIL", engine, name, repr(sentence), "expected:", expected, engine + ":", found)
+    if failures > 0:
+        print(failures, "of", len(cases), "cases failed")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# tracing.py
+# course "Parsing"
+
+# Tracing by events instead of print statements.
+# The parsers (question3.py, 5_2.py, 7_2.py, 7_3.py, cyk_skeleton.py, 5_1.py, earley.py, lr_parser.py, glr.py)
+# have a module variable trace, which is either None (no tracing) or a subscriber: a procedure that is called as
+#     trace(event, **data)
+# for every processing step. In the main loops, this is guarded by "if trace:", so with trace = None
+# the only cost is that test (no string formatting, and the event data are not even computed).
+#
+# events and their data:
+#     "parse":     tokens, method (None or a name like "memoized")    parsing starts
+#     "item":      stack, rest         the agenda item (stack and remaining input) that is processed next
+#     "expand":    symbol, rhs, pos    top-down expansion (pos only for the memoized search)
+#     "match":     symbol              a terminal on the stack matches the next input token
+#     "memo":      symbol, pos, ends   a memoized expansion is reused
+#     "merge":     stack, rest         a configuration that is already on the agenda (or done) is reached again
+#     "shift":     symbol
+#     "reduce":    rhs, lhs
+#     "backtrack": reason              the agenda item is a dead end
+#     "conflict":  state, token, actions   LR: several actions for the next token (the parser forks)
+#     "success" / "accept":            a complete parse was found
+#     "solutions": count, nodes        parsing is finished (nodes: size of the GLR forest, if any)
+#     "solution":  number, deriv       a solution is read out (its number and derivation)
+#     "frontier":  pos, tops, next     GLR: the states on top of the graph-structured stack before pos
+#     "state":     lhs, rhs, dot, origin, end   Earley: a new item in the chart
+#     "column":    j                   CYK: the cells ending at j are filled next
+#     "row":       i                   CYK: cell (i, j) is filled next
+#     "split":     i, k, j             CYK: split point k of cell (i, j)
+#     "found":     left, right, lhs    CYK: the rules lhs -> left right apply at the current split point
+#     "cell":      i, j, symbols       CYK: cell (i, j) is complete
+#     "span":      length              CYK recognizer: all cells of this length are complete
+#     "chart":     table, pointers     CYK: the final chart
+#     "unknown":   token               a token that is not in the grammar
+#     "not_cnf":   lhs, rhs            CYK grammar loading: a rule that is not in CNF
+#     "convert":   count               CYK grammar loading: the rules that are not in CNF are converted
+#     "nullable":  symbols             CNF conversion: the non-terminals that derive the empty string
+#     "empty_string": symbol           CNF conversion: the start symbol derives the empty string (which CYK cannot parse)
+#     "pointers":  symbol, i, j, pointers   CYK tree read-out: the backpointers of a chart entry
+#
+# Subscribers: print_events (prints the events in the format of the old trace output),
+# printer(actions=False) (only the agenda items), collector(events) (stores them for inspection).
+
+action_events = {"expand", "match", "memo", "merge", "shift", "reduce", "backtrack", "conflict"}
+
+
+def print_event(event, data):
+    if event == "parse":
+        if data.get("method") is None:
+            print("parsing ", data["tokens"], "...")
+        else:
+            print("parsing ", data["tokens"], "(" + data["method"] + ") ...")
+    elif event == "item":
+        print('           {:<40}{:>40}'.format(str(data["stack"]), str(data["rest"])))
+    elif event == "expand":
+        if data.get("pos") is None:
+            print(" >expand: ", data["symbol"], " -R-> ", data["rhs"])
+        else:
+            print(" >expand: ", data["symbol"], " -R-> ", data["rhs"], "at", data["pos"])
+    elif event == "match":
+        print(" >match:  ", data["symbol"])
+    elif event == "memo":
+        print(" >memo:   ", data["symbol"], "at", data["pos"], "->", sorted(data["ends"]))
+    elif event == "merge":
+        print(" >merge:  ", data["stack"], data["rest"])
+    elif event == "shift":
+        print(" >shift:  ", data["symbol"])
+    elif event == "reduce":
+        print(" >reduce: ", list(data["rhs"]), " -R-> ", data["lhs"])
+    elif event == "backtrack":
+        print(" >backtracking (" + data["reason"] + ")")
+    elif event == "conflict":
+        print(" >conflict in state", data["state"], "on", data["token"], ":", data["actions"])
+    elif event == "success":
+        print(" >success!")
+    elif event == "accept":
+        print(" >accept!")
+    elif event == "solutions":
+        if data.get("nodes") is None:
+            print(data["count"], ' solutions')
+        else:
+            print(data["count"], ' solutions,', data["nodes"], 'forest nodes')
+    elif event == "solution":
+        print("solution ", data["number"])
+        print(data["deriv"])
+    elif event == "frontier":
+        print("position", data["pos"], "stack tops:", data["tops"], "next:", data["next"])
+    elif event == "state":
+        dotted = data["lhs"] + " -> " + " ".join(data["rhs"][:data["dot"]]) + " . " + " ".join(data["rhs"][data["dot"]:])
+        print('           {:<60}{:>10}'.format(dotted, str((data["origin"], data["end"]))))
+    elif event == "column":
+        print("j:", data["j"])
+    elif event == "row":
+        print("   i:", data["i"])
+    elif event == "split":
+        print("     k:", data["k"])
+        print("          ", data["i"], data["k"], data["j"])
+    elif event == "found":
+        print("           found", data["left"], data["right"], ":", data["lhs"])
+    elif event == "cell":
+        print("cell", (data["i"], data["j"]), "filled:", data["symbols"])
+    elif event == "span":
+        print("span length", data["length"], "done")
+    elif event == "chart":
+        print("table:", data["table"])
+        print("pointers:", data["pointers"])
+    elif event == "unknown":
+        print("Warning -- unknown token:", data["token"])
+    elif event == "not_cnf":
+        print("The rule ", data["lhs"], "-->", list(data["rhs"]), " is not in CNF")
+    elif event == "convert":
+        print("\nconverting", data["count"], "rules to CNF\n")
+    elif event == "nullable":
+        print("nullable nonterminals:", data["symbols"])
+    elif event == "empty_string":
+        print("Warning -- the empty string is in the language, but cannot be parsed with CYK")
+    elif event == "pointers":
+        print("going through list", data["pointers"])
+    else:
+        print(event, data)
+
+
+def printer(actions=True):
+    # subscriber printing the events; with actions=False, the parser actions (expand, match, ...) are left out
+    def subscriber(event, **data):
+        if actions or event not in action_events:
+            print_event(event, data)
+    return subscriber
+
+
+print_events = printer()
+
+
+def collector(events):
+    # subscriber appending the events to the list events, as pairs (event, data dict)
+    def subscriber(event, **data):
+        events.append((event, data))
+    return subscriber